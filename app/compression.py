@@ -0,0 +1,217 @@
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from metrics import metrics
+
+# brotli и zstd необязательны: без библиотек ответы сжимаются только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+Сжатие ответов по Accept-Encoding. Списки и поиск заметок - json с длинными текстами, сжимаются в несколько раз.
+Ответ целиком сжимается, только если он не меньше minimum_size: маленькие ответы от сжатия почти
+не уменьшаются, а процессор тратят. Потоковые ответы (выгрузка) сжимаются по мере отправки:
+каждая часть сжимается и сразу отправляется со сбросом буфера компрессора, тело не накапливается.
+"""
+
+# типы, которые имеет смысл сжимать; картинки и архивы уже сжаты
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript",
+                      "application/xml")
+
+
+class Compressor(ABC):
+    """
+    Потоковый компрессор одного ответа: compress сжимает часть тела и сбрасывает буфер,
+    чтобы клиент мог распаковать все отправленное, finish дописывает конец потока
+    """
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        ...
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def available_encodings(gzip_level: int, brotli_quality: int, zstd_level: int) -> Dict[str, Callable[[], Compressor]]:
+    """
+    Поддерживаемые кодировки в порядке предпочтения сервера: при равном q у клиента выбирается первая
+    """
+    encodings = {}
+    # zstd при сравнимом размере тратит меньше всего процессора (benchmarks.compression)
+    if zstandard is not None:
+        encodings["zstd"] = lambda: ZstdCompressor(zstd_level)
+    if brotli is not None:
+        encodings["br"] = lambda: BrotliCompressor(brotli_quality)
+    encodings["gzip"] = lambda: GzipCompressor(gzip_level)
+    return encodings
+
+
+def negotiate(accept_encoding: str, supported) -> Optional[str]:
+    """
+    Выбирает кодировку по Accept-Encoding с учетом q: кодировки с q=0 запрещены, * - любая из поддерживаемых
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def is_compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def add_vary(headers: MutableHeaders):
+    vary = headers.get("vary")
+    if not vary:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы gzip, а при установленных brotli/zstandard - и br/zstd, если клиент их принимает.
+    Чистая ASGI-мидлвара: обычный ответ сжимается целиком одним вызовом, потоковый - по частям без буферизации.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 4, brotli_quality: int = 4,
+                 zstd_level: int = 3):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings(gzip_level, brotli_quality, zstd_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept_encoding = Headers(scope=scope).get("accept-encoding")
+        encoding = negotiate(accept_encoding, self.encodings) if accept_encoding else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        compressor: Optional[Compressor] = None
+        passthrough = False
+        raw_bytes = 0
+        compressed_bytes = 0
+        seconds = 0.0
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough, raw_bytes, compressed_bytes, seconds
+            if message["type"] == "http.response.start":
+                # заголовки отправляем вместе с первой частью тела, когда станет ясно, сжимать ли ответ
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                start_message["headers"] = list(start_message.get("headers", []))
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not is_compressible(headers) or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    if is_compressible(headers):
+                        add_vary(headers)
+                    await send(start_message)
+                    return await send(message)
+
+                compressor = self.encodings[encoding]()
+                headers["Content-Encoding"] = encoding
+                add_vary(headers)
+                del headers["content-length"]
+                # сжатое тело - другое представление, совпадение байт в байт уже не гарантируется
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if not more_body:
+                    started = time.perf_counter()
+                    data = compressor.compress(body) + compressor.finish()
+                    seconds += time.perf_counter() - started
+                    headers["Content-Length"] = str(len(data))
+                    metrics.observe_compression(encoding, len(body), len(data), seconds)
+                    await send(start_message)
+                    return await send({"type": "http.response.body", "body": data})
+                await send(start_message)
+
+            started = time.perf_counter()
+            data = compressor.compress(body) if body else b""
+            if not more_body:
+                data += compressor.finish()
+            seconds += time.perf_counter() - started
+            raw_bytes += len(body)
+            compressed_bytes += len(data)
+            if not more_body:
+                metrics.observe_compression(encoding, raw_bytes, compressed_bytes, seconds)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from typing import Union, ClassVar
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -30,6 +31,65 @@ class Settings(BaseSettings):
     FASTAPI_URL: str
     JWT_SECRET: str
 
+    # настройки пула соединений с БД
+    DB_NULLPOOL: bool = False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 256
+
+    # индекс тегов для автодополнения
+    TAG_INDEX_MAX_USERS: int = 10000
+    TAG_INDEX_TTL: int = 300
+
+    # кэш ответов на чтение заметок
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_TTL: int = 300
+
+    # кэш пользователей по JWT и telegram_id, ttl короткий: другие воркеры узнают об изменениях только по нему
+    AUTH_CACHE_ENABLED: bool = True
+    AUTH_CACHE_MAX_SIZE: int = 10000
+    AUTH_CACHE_TTL: int = 60
+
+    # хэширование паролей в пуле потоков: число потоков, длина очереди, параметры argon2.
+    # После изменения параметров хэш пароля пересчитывается при следующем входе пользователя
+    PASSWORD_HASH_WORKERS: int = min(4, os.cpu_count() or 1)
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    PASSWORD_ARGON2_TIME_COST: int = 3
+    PASSWORD_ARGON2_MEMORY_COST: int = 65536
+    PASSWORD_ARGON2_PARALLELISM: int = 4
+
+    # лимитер запросов: корзины хранятся в файле, общем для всех воркеров на машине
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_STORAGE_PATH: str = os.path.join(tempfile.gettempdir(), "notes_rate_limit.sqlite3")
+    # сколько секунд лимитер повторяет запись в занятый другим воркером файл, прежде чем пропустить запрос
+    RATE_LIMIT_TIMEOUT: float = 0.0002
+
+    # логирование: json в консоль, доля записываемых успешных запросов, порог медленного запроса
+    LOG_LEVEL: str = "INFO"
+    LOG_DIR: str = "logs"
+    LOG_RETENTION: str = "10 days"
+    LOG_JSON: bool = False
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_SLOW_REQUEST_MS: float = 1000.0
+
+    # метрики Prometheus на /metrics
+    METRICS_ENABLED: bool = True
+    # заголовок Server-Timing с числом SQL-выражений и временем в БД, по умолчанию выключен:
+    # раскрывает внутренние детали обработки запроса
+    SERVER_TIMING_ENABLED: bool = False
+
+    # сжатие ответов: gzip всегда, br и zstd - если установлены brotli и zstandard.
+    # Ответы меньше порога (в байтах) не сжимаются, уровни - компромисс между размером и временем процессора
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 4
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_ZSTD_LEVEL: int = 3
+
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
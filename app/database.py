@@ -1,8 +1,11 @@
+import time
 from typing import AsyncGenerator
 
-from sqlalchemy import NullPool
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import NullPool, event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import queue as sqla_queue
 from config import settings
 
 DATABASE_URL = settings.DB_URL
@@ -11,8 +14,82 @@ DATABASE_URL = settings.DB_URL
 class Base(DeclarativeBase):
     pass
 
+
+class PoolStats:
+    """
+    Счетчики пула соединений. Обновляются из событий пула, поэтому
+    чтение не требует обращения к БД и ничего не стоит.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.wait_count += 1
+        self.wait_total += seconds
+        if seconds > self.wait_max:
+            self.wait_max = seconds
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """
+    Пул, который замеряет время ожидания свободного соединения при checkout.
+    Ожиданием считается только checkout, когда свободных соединений нет и открыть новое нельзя:
+    выдача простаивающего соединения и открытие нового в пределах max_overflow - не ожидание.
+    """
+
+    def _do_get(self):
+        # сначала берем простаивающее соединение без ожидания: блокирующий get пула уступает event loop
+        # даже при непустой очереди, и по состоянию пула до вызова нельзя понять, будет ли ожидание
+        try:
+            return self._pool.get(False)
+        except sqla_queue.Empty:
+            pass
+        if self._max_overflow < 0 or self.overflow() < self._max_overflow:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+def create_engine(nullpool: bool = settings.DB_NULLPOOL) -> AsyncEngine:
+    """
+    Создаем асинхронный движок. По умолчанию используется пул соединений с параметрами из настроек,
+    NullPool оставлен для миграций и сравнения в бенчмарке.
+    asyncpg кэширует подготовленные выражения на каждом соединении, размер кэша ограничен настройкой.
+    """
+    connect_args = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    if nullpool:
+        return create_async_engine(DATABASE_URL, poolclass=NullPool, connect_args=connect_args)
+    return create_async_engine(
+        DATABASE_URL,
+        poolclass=InstrumentedAsyncPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
 # используем асинхронный движок для базы данных
-async_engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+async_engine = create_engine()
 async_session_maker = async_sessionmaker(
     async_engine,
     expire_on_commit=False,
@@ -20,6 +97,52 @@ async_session_maker = async_sessionmaker(
 )
 
 
+@event.listens_for(async_engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.connects += 1
+
+
+@event.listens_for(async_engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.checkouts += 1
+
+
+@event.listens_for(async_engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.checkins += 1
+
+
+@event.listens_for(async_engine.sync_engine, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.invalidations += 1
+
+
+def get_pool_stats() -> dict:
+    """
+    Текущее состояние пула и накопленные счетчики
+    """
+    pool = async_engine.pool
+    stats = {
+        "pool_class": type(pool).__name__,
+        "connects": pool_stats.connects,
+        "checkouts": pool_stats.checkouts,
+        "checkins": pool_stats.checkins,
+        "invalidations": pool_stats.invalidations,
+        "timeouts": pool_stats.timeouts,
+        "wait_count": pool_stats.wait_count,
+        "wait_total_seconds": round(pool_stats.wait_total, 6),
+        "wait_max_seconds": round(pool_stats.wait_max, 6),
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    return stats
+
+
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
@@ -1,4 +1,265 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import asyncio
+import functools
+import math
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
 
-limiter = Limiter(key_func=get_remote_address)
+from fastapi import HTTPException, Request
+from loguru import logger
+from starlette import status
+
+from config import settings
+from metrics import metrics
+
+RATE_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+"""
+Token bucket в общем файле SQLite: у каждой пары (хэндлер, пользователь) своя корзина емкостью burst токенов,
+которая пополняется со скоростью rate. Запрос забирает один токен, пустая корзина - ответ 429.
+Корзина пересчитывается и списывается одним UPSERT ... RETURNING, поэтому проверка атомарна
+и для нескольких воркеров uvicorn, работающих с одним файлом.
+"""
+BUCKET_SQL = """
+INSERT INTO buckets (key, tokens, updated_at, allowed)
+VALUES (:key, :capacity - 1, :now, 1)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = min(:capacity, tokens + (:now - updated_at) * :rate)
+             - (min(:capacity, tokens + (:now - updated_at) * :rate) >= 1),
+    allowed = min(:capacity, tokens + (:now - updated_at) * :rate) >= 1,
+    updated_at = :now
+RETURNING tokens, allowed
+"""
+
+
+def parse_rate(rate: str) -> Tuple[int, float]:
+    """
+    "30/minute" или "100/5 minutes" -> (30, 60.0)
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*", rate)
+    if not match:
+        raise ValueError(f"Invalid rate: {rate}")
+    count, multiplier, period = match.groups()
+    return int(count), int(multiplier or 1) * RATE_PERIODS[period]
+
+
+class RateLimiter:
+    """
+    Лимитер запросов по пользователю: ключ - id пользователя из JWT, иначе telegram_id из пути, иначе IP.
+    Обычно проверка выполняется синхронно прямо в обработчике: UPSERT в файл в режиме WAL без fsync занимает
+    десятки микросекунд, что дешевле переключения в поток (поток еще и ждет GIL у занятого event loop).
+    Чтобы проверка не останавливала event loop, в нем она никогда не ждет блокировку файла: встроенное
+    ожидание SQLite отключено, занятый другим воркером файл опрашивается повторно не дольше timeout секунд
+    (сотни микросекунд). Если файл все еще занят, списание уходит в поток лимитера и ждет там, а event loop
+    тем временем обслуживает другие запросы. Ошибка хранилища пропускает запрос - лимитер не должен ронять апи.
+    Все, что может занять миллисекунды, - checkpoint журнала с fsync и чистка старых корзин - тоже
+    выполняется в потоке лимитера со своим соединением.
+    """
+
+    def __init__(self, path: str, enabled: bool = True, timeout: float = 0.0002, checkpoint_interval: float = 1.0,
+                 busy_timeout: float = 0.05):
+        self.path = path
+        self.enabled = enabled
+        self.timeout = timeout
+        self.checkpoint_interval = checkpoint_interval
+        self.busy_timeout = busy_timeout
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._maintenance: Optional[Future] = None
+        self._thread_connection: Optional[sqlite3.Connection] = None
+        self._last_checkpoint = 0.0
+        self._last_purge = 0.0
+
+    def limit(self, rate: str, burst: Optional[int] = None):
+        """
+        Декоратор хэндлера. Хэндлер должен принимать request: Request.
+        :param rate: средняя скорость, например "30/minute"
+        :param burst: сколько запросов можно сделать подряд, по умолчанию равно числу запросов в rate
+        """
+        count, period = parse_rate(rate)
+        capacity = burst or count
+        refill = count / period
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.get("request")
+                if self.enabled and request is not None:
+                    key = f"{func.__name__}:{self.get_principal(request, kwargs)}"
+                    allowed, tokens = await self.hit(key, capacity, refill)
+                    headers = {
+                        "X-RateLimit-Limit": str(capacity),
+                        "X-RateLimit-Remaining": str(max(0, math.floor(tokens))),
+                        # через сколько секунд корзина снова будет полной
+                        "X-RateLimit-Reset": str(math.ceil((capacity - tokens) / refill)),
+                    }
+                    if not allowed:
+                        metrics.observe_rate_limited(func.__name__)
+                        headers["Retry-After"] = str(max(1, math.ceil((1 - tokens) / refill)))
+                        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                            detail="Rate limit exceeded. Please try again later.",
+                                            headers=headers)
+                    request.state.rate_limit_headers = headers
+                return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @staticmethod
+    def get_principal(request: Request, kwargs: dict) -> str:
+        user = kwargs.get("user")
+        if user is not None:
+            return f"user:{user.id}"
+        if kwargs.get("telegram_id") is not None:
+            return f"tg:{kwargs['telegram_id']}"
+        return f"ip:{request.client.host if request.client else 'unknown'}"
+
+    async def hit(self, key: str, capacity: int, rate: float) -> Tuple[bool, float]:
+        """
+        Забирает токен из корзины key. Возвращает, разрешен ли запрос, и сколько токенов осталось.
+        """
+        now = time.time()
+        params = {"key": key, "capacity": capacity, "rate": rate, "now": now}
+        try:
+            result = self._take_nowait(params)
+            if result is None:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, self._take_in_thread, params)
+            self._schedule_maintenance(now)
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limiter storage error, request allowed: {e}")
+            return True, capacity
+        tokens, allowed = result
+        return bool(allowed), tokens
+
+    def _take_nowait(self, params: dict) -> Optional[Tuple[float, int]]:
+        """
+        Списание в event loop без ожидания блокировки; None - файл занят дольше timeout
+        """
+        connection = self._connect()
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            try:
+                # fetchall доводит выражение до конца, и транзакция сразу фиксируется
+                return connection.execute(BUCKET_SQL, params).fetchall()[0]
+            except sqlite3.OperationalError as e:
+                # запись держит другой воркер, обычно десятки микросекунд
+                if e.sqlite_errorcode != sqlite3.SQLITE_BUSY:
+                    raise
+                if time.perf_counter() >= deadline:
+                    return None
+
+    def reset(self):
+        """
+        Очищает все корзины
+        """
+        self._connect().execute("DELETE FROM buckets")
+
+    def shutdown(self):
+        """
+        Закрывает соединения и поток лимитера. Лимитер остается рабочим: следующий hit откроет их заново
+        """
+        # поток есть только в процессе, который его создал, в дочернем процессе ждать его нельзя
+        if self._executor is not None and self._pid == os.getpid():
+            # соединение потока закрывается в нем же, после уже поставленных задач
+            self._executor.submit(self._close_thread_connection)
+            self._executor.shutdown(wait=True)
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = self._pid = self._executor = self._maintenance = None
+
+    def _schedule_maintenance(self, now: float):
+        """
+        Раз в checkpoint_interval секунд отдает потоку лимитера checkpoint журнала, раз в 5 минут - чистку.
+        Event loop только ставит задачу в очередь, пока предыдущая не закончилась, новая не ставится.
+        """
+        if now - self._last_checkpoint < self.checkpoint_interval:
+            return
+        if self._maintenance is not None and not self._maintenance.done():
+            return
+        self._last_checkpoint = now
+        purge = now - self._last_purge > 300
+        if purge:
+            self._last_purge = now
+        self._maintenance = self._executor.submit(self._maintain, now, purge)
+
+    # ----------- выполняется в потоке лимитера, здесь ждать блокировку и fsync можно -------------
+
+    def _thread_connect(self) -> sqlite3.Connection:
+        if self._thread_connection is None:
+            self._thread_connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            self._thread_connection.execute("PRAGMA synchronous=NORMAL")
+        return self._thread_connection
+
+    def _close_thread_connection(self):
+        if self._thread_connection is not None:
+            self._thread_connection.close()
+            self._thread_connection = None
+
+    def _take_in_thread(self, params: dict) -> Tuple[float, int]:
+        return self._thread_connect().execute(BUCKET_SQL, params).fetchall()[0]
+
+    def _maintain(self, now: float, purge: bool):
+        try:
+            connection = self._thread_connect()
+            if purge:
+                # корзина, которую не трогали сутки, заведомо полная - такая же, как отсутствующая
+                connection.execute("DELETE FROM buckets WHERE updated_at < ?", (now - RATE_PERIODS["day"],))
+            connection.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limiter storage maintenance failed: {e}")
+
+    def _connect(self) -> sqlite3.Connection:
+        # соединение и поток нельзя переносить между процессами, каждый воркер открывает свои
+        if self._connection is None or self._pid != os.getpid():
+            # timeout=0: SQLite не ждет блокировку сам, повторы с ограничением по времени делает hit
+            connection = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # в WAL при NORMAL коммит не делает fsync, файл синхронизируется только при checkpoint.
+            # При сбое питания теряются последние списания токенов, но файл не повреждается
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # автоматический checkpoint выполнялся бы в event loop внутри коммита, делаем его в потоке
+            connection.execute("PRAGMA wal_autocheckpoint=0")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, allowed INTEGER NOT NULL)"
+            )
+            self._connection, self._pid = connection, os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limiter")
+            self._maintenance = None
+            self._thread_connection = None
+        return self._connection
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Добавляет заголовки X-RateLimit-*, которые лимитер сохранил в request.state, к ответу хэндлера.
+    Чистая ASGI-мидлвара: тело ответа не буферизуется.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = scope.get("state", {}).get("rate_limit_headers")
+                if headers:
+                    present = {name.lower() for name, _ in message.get("headers", [])}
+                    extra = [(name.lower().encode(), value.encode()) for name, value in headers.items()
+                             if name.lower().encode() not in present]
+                    message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+limiter = RateLimiter(settings.RATE_LIMIT_STORAGE_PATH, enabled=settings.RATE_LIMIT_ENABLED,
+                      timeout=settings.RATE_LIMIT_TIMEOUT)
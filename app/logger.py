@@ -1,60 +1,235 @@
+import atexit
+import json
 import os
-from loguru import logger
-from fastapi import Request, HTTPException
+import queue
+import random
+import re
 import sys
-from datetime import datetime
+import threading
+import time
+import traceback
+import uuid
+from typing import Optional
+
+from fastapi import Request, HTTPException
+from fastapi.exception_handlers import http_exception_handler as default_http_exception_handler
+from loguru import logger
 from starlette.responses import JSONResponse
-from main import app
+
+from config import settings
+from metrics import metrics, route_template, track_queries
 
 """
 настраиваем логгер для вывода в консоль и для сохранения файлов в папку logs
 логи будут обновляться раз в день в 00:00, срок хранения 10 дней
+
+Обработчик запроса только кладет запись в очередь в памяти, форматирование, запись в консоль и файл,
+ротация и сжатие архива выполняются в фоновом потоке LogWriter.
+В файл пишутся json-записи, по одной на строку.
 """
 
-log_dir = "logs"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-logger.remove()
-logger.add(
-    sys.stderr, format="{time} {level} {message}", level="INFO", colorize=True
-)
-logger.add(
-    f"{log_dir}/{datetime.now().strftime('%Y-%m-%d')}.log",
-    rotation="00:00",
-    retention="10 days",
-    compression="zip"
-)
-
-
-# логгер будет работать на уровне мидлвары
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url}")
-    try:
-        response = await call_next(request)
-        logger.info(f"Response status: {response.status_code}")
-        return response
-    except Exception as e:
-        logger.error(f"Error during request: {request.method} {request.url} - {e}")
-        raise
+REQUEST_ID_HEADER = "x-request-id"
+_request_id_re = re.compile(r"^[\w.-]{1,64}$")
+
+
+def json_line(record) -> str:
+    """
+    json-запись: время, уровень, сообщение и все поля, привязанные через bind/contextualize
+    """
+    payload = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "message": record["message"],
+        **record["extra"],
+    }
+    if record["exception"] is not None:
+        payload["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    return json.dumps(payload, default=str, ensure_ascii=False) + "\n"
+
+
+def text_line(record) -> str:
+    line = f"{record['time']} {record['level'].name} {record['message']}\n"
+    if record["exception"] is not None:
+        line += "".join(traceback.format_exception(*record["exception"]))
+    return line
+
+
+class LogWriter:
+    """
+    Фоновый поток записи логов. Обработчик loguru в потоке запроса только кладет запись
+    в queue.SimpleQueue - это дешевле enqueue=True у loguru, который сериализует каждую запись через pickle
+    и пишет ее в pipe. Поток форматирует записи и пишет их в консоль и в файловый приемник loguru,
+    поэтому ротация и сжатие архива тоже выполняются здесь, а не в event loop.
+    """
+
+    def __init__(self, console, json_console: bool):
+        self.console = console
+        self.json_console = json_console
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, message):
+        # приемник loguru: вызывается в потоке, который пишет лог
+        self.queue.put(message.record)
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        # записи этого потока идут только в файловый приемник
+        file_logger = logger.bind(log_writer=True)
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            try:
+                line = json_line(record)
+                file_logger.opt(raw=True).log(record["level"].name, line)
+                self.console.write(line if self.json_console else text_line(record))
+                if self.queue.empty():
+                    self.console.flush()
+            except Exception as e:
+                sys.__stderr__.write(f"Log writer error: {e}\n")
+
+
+_writer: Optional[LogWriter] = None
+
+
+def setup_logging(log_dir: str = settings.LOG_DIR, console=sys.stderr):
+    global _writer
+    os.makedirs(log_dir, exist_ok=True)
+
+    logger.remove()
+    stop_logging()
+    _writer = LogWriter(console, json_console=settings.LOG_JSON)
+    logger.add(
+        _writer.put,
+        format="{message}",
+        level=settings.LOG_LEVEL,
+        filter=lambda record: "log_writer" not in record["extra"],
+    )
+    logger.add(
+        os.path.join(log_dir, "{time:YYYY-MM-DD}.log"),
+        format="{message}",
+        level=settings.LOG_LEVEL,
+        filter=lambda record: "log_writer" in record["extra"],
+        rotation="00:00",
+        retention=settings.LOG_RETENTION,
+        compression="zip",
+    )
+
+
+def stop_logging():
+    """
+    Дописывает накопившиеся в очереди записи и останавливает фоновый поток
+    """
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+atexit.register(stop_logging)
+
+
+class RequestLogMiddleware:
+    """
+    Лог запросов: одна структурированная запись на запрос с методом, шаблоном маршрута, статусом,
+    временем обработки, пользователем и request id. Чистая ASGI-мидлвара: тело ответа не буферизуется.
+    Успешные быстрые запросы пишутся с вероятностью sample_rate, ошибки и медленные запросы - всегда.
+    Request id берется из заголовка X-Request-ID или генерируется, возвращается в ответе
+    и привязывается ко всем записям, сделанным во время обработки запроса.
+    В запись попадают число SQL-выражений и время в БД; с server_timing они же отдаются
+    в заголовке Server-Timing, который показывают инструменты разработчика браузера.
+    """
+
+    def __init__(self, app, sample_rate: float = settings.LOG_SAMPLE_RATE,
+                 slow_request_ms: float = settings.LOG_SLOW_REQUEST_MS,
+                 server_timing: bool = settings.SERVER_TIMING_ENABLED):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_request_ms = slow_request_ms
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER.encode():
+                value = value.decode("latin-1")
+                request_id = value if _request_id_re.match(value) else None
+                break
+        request_id = request_id or uuid.uuid4().hex
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+                if self.server_timing:
+                    headers.append((b"server-timing", server_timing(queries, start).encode()))
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        with logger.contextualize(request_id=request_id), track_queries() as queries:
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            except Exception:
+                status_code = 500
+                raise
+            finally:
+                self.log(scope, status_code, (time.perf_counter() - start) * 1000, queries)
+
+    def log(self, scope, status_code: int, latency_ms: float, queries):
+        if status_code < 400 and latency_ms < self.slow_request_ms and random.random() >= self.sample_rate:
+            return
+        route = scope.get("route")
+        # шаблон маршрута, а не сам путь: /notes/tg/{telegram_id}, а не /notes/tg/12345
+        path = getattr(route, "path", None) or scope["path"]
+        state = scope.get("state", {})
+        fields = {
+            "method": scope["method"],
+            "route": path,
+            "status": status_code,
+            "latency_ms": round(latency_ms, 3),
+            "user_id": state.get("user_id"),
+            "telegram_id": scope.get("path_params", {}).get("telegram_id"),
+            "db_statements": queries.statements,
+            "db_ms": round(queries.seconds * 1000, 3),
+        }
+        level = "ERROR" if status_code >= 500 else "WARNING" if status_code >= 400 else "INFO"
+        logger.bind(**fields).log(level, f"{scope['method']} {path} {status_code} {latency_ms:.1f}ms")
+
+
+def server_timing(queries, start: float) -> str:
+    # время до начала ответа: тело еще не отправлено, но все запросы к БД обычно уже выполнены
+    app_ms = (time.perf_counter() - start) * 1000
+    return (f'db;dur={queries.seconds * 1000:.1f};desc="{queries.statements} queries", '
+            f'app;dur={app_ms:.1f}')
+
+
+def register_exception_handlers(app):
+    app.add_exception_handler(Exception, global_exception_handler)
+    app.add_exception_handler(HTTPException, http_exception_handler)
 
 
 # перехватываем ошибки сервера с кодом 500
-@app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled Exception: {exc} from {request.url}")
+    logger.opt(exception=exc).error(f"Unhandled Exception: {exc} from {request.url.path}")
+    metrics.observe_unhandled_error(route_template(request.scope), exc)
     return JSONResponse(
         status_code=500,
         content={"message": "An internal error occurred. Please try again later."}
     )
 
 
-# перехватываем остальные ошибки с другими HTTP кодами и отдаем детали в ответе
-@app.exception_handler(HTTPException)
+# остальные ошибки с HTTP кодами логируем и отдаем в стандартном для FastAPI формате
 async def http_exception_handler(request: Request, exc: HTTPException):
-    logger.warning(f"HTTP Exception: {exc.detail} on {request.url}")
-    return JSONResponse(
-        status_code=exc.status_code,
-        content={"message": exc.detail},
-    )
+    logger.warning(f"HTTP Exception: {exc.detail} on {request.url.path}")
+    return await default_http_exception_handler(request, exc)
@@ -1,22 +1,33 @@
 from fastapi import FastAPI
 
-from slowapi.middleware import SlowAPIMiddleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 
-from limiter import limiter
+from compression import CompressionMiddleware
+from config import settings
+from database import async_engine, get_pool_stats
+from limiter import RateLimitHeadersMiddleware, limiter
+from logger import RequestLogMiddleware, register_exception_handlers, setup_logging, stop_logging
+from metrics import MetricsMiddleware, metrics
+from notes.cache import response_cache
 from notes.routers import router as notes_router
+from users.passwords import password_pool
 from users.routers import router as users_router
 
+setup_logging()
+
 app = FastAPI()
-app.state.limiter = limiter
+register_exception_handlers(app)
 
 
-@app.on_event("startup")
-async def startup_event():
-    # запускаем лимитер вместе с запуском приложения
-    app.state.limiter = limiter
-#     asyncio.create_task(main())
+@app.on_event("shutdown")
+async def shutdown_event():
+    # закрываем соединения из пула при остановке приложения
+    await async_engine.dispose()
+    password_pool.shutdown()
+    limiter.shutdown()
+    # дописываем логи, оставшиеся в очереди
+    stop_logging()
 
 
 # тестовый хэндлер для проверки доступности сервера
@@ -25,18 +36,39 @@ async def root():
     return {"message": "Hello World"}
 
 
+# состояние пула соединений с БД: занятые соединения, overflow, время ожидания
+@app.get("/db/pool")
+async def db_pool_stats():
+    return get_pool_stats()
+
+
+# счетчики кэша ответов: попадания, промахи, вытеснения, занятая память
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.stats()
+
+
+# метрики в текстовом формате Prometheus
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 app.include_router(users_router)
 app.include_router(notes_router)
 
-app.add_middleware(SlowAPIMiddleware)
+# заголовки X-RateLimit-* для ответов хэндлеров с лимитом
+app.add_middleware(RateLimitHeadersMiddleware)
 
 
-# настраиваем ответ пользователю от лимитера
+# настраиваем ответ пользователю от лимитера, Retry-After и X-RateLimit-* берем из исключения
 @app.exception_handler(429)
 async def rate_limit_exceeded(request, exc):
     return JSONResponse(
         status_code=429,
         content={"detail": "Rate limit exceeded. Please try again later."},
+        headers=getattr(exc, "headers", None),
     )
 
 # добавим CORS мидлвару для ограничения доступа со сторонних хостов
@@ -46,4 +78,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PATCH", "DELETE"],
     allow_headers=["*"],
-)
\ No newline at end of file
+)
+
+# сжатие ответов: снаружи CORS и лимитера, чтобы сжимать уже готовые ответы со всеми заголовками
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MIN_SIZE,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+        zstd_level=settings.COMPRESSION_ZSTD_LEVEL,
+    )
+
+# метрики запросов по шаблону маршрута
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# лог запросов - самая внешняя мидлвара, чтобы время обработки учитывало и остальные мидлвары
+app.add_middleware(RequestLogMiddleware)
@@ -0,0 +1,321 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import async_engine, get_pool_stats
+
+"""
+Метрики приложения в текстовом формате Prometheus.
+Счетчики - обычные словари и списки без блокировок: все запросы обрабатываются в одном потоке event loop,
+а отдельные операции со словарем под GIL атомарны. Метки маршрута - шаблон пути из FastAPI,
+а не сам путь с id, поэтому число рядов ограничено числом хэндлеров.
+"""
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class QueryStats:
+    """
+    SQL-выражения одного запроса: количество и суммарное время выполнения в БД.
+    Выражения одного запроса выполняются по очереди, поэтому хватает одной отметки начала.
+    """
+
+    def __init__(self, record: bool = False):
+        self.statements = 0
+        self.seconds = 0.0
+        self.started = 0.0
+        # тексты выражений, собираются только по запросу: нужны для сообщений в тестах
+        self.log: Optional[List[str]] = [] if record else None
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries(record: bool = False):
+    """
+    Считает SQL-выражения внутри блока. Если счетчик уже открыт выше по стеку вызовов (например, мидлварой),
+    используется он, чтобы все участники видели одни и те же цифры.
+    """
+    stats = _query_stats.get()
+    if stats is not None:
+        if record and stats.log is None:
+            stats.log = []
+        yield stats
+        return
+    stats = QueryStats(record)
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами. Хранит количество наблюдений в каждом интервале,
+    накопленные значения для формата Prometheus считаются только при отдаче метрик.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        result, total = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((format_value(bound), total))
+        result.append(("+Inf", self.count))
+        return result
+
+
+class Metrics:
+    """
+    Реестр метрик процесса. У каждого воркера uvicorn свой реестр, Prometheus собирает их по отдельности.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.statements: Dict[Tuple[str, str], Histogram] = {}
+        self.db_time: Dict[Tuple[str, str], Histogram] = {}
+        self.rate_limited: Dict[str, int] = defaultdict(int)
+        self.unhandled_errors: Dict[Tuple[str, str], int] = defaultdict(int)
+        # пул хэширования паролей
+        self.password_in_flight = 0
+        self.password_queued = 0
+        self.password_wait: Dict[str, Histogram] = {}
+        self.password_duration: Dict[str, Histogram] = {}
+        self.password_rejected: Dict[str, int] = defaultdict(int)
+        # сжатие ответов по кодировкам
+        self.compression_responses: Dict[str, int] = defaultdict(int)
+        self.compression_bytes_in: Dict[str, int] = defaultdict(int)
+        self.compression_bytes_out: Dict[str, int] = defaultdict(int)
+        self.compression_seconds: Dict[str, float] = defaultdict(float)
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float, queries: QueryStats):
+        self.requests[(method, route, status_code)] += 1
+        key = (method, route)
+        latency = self.latency.get(key)
+        if latency is None:
+            latency = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.statements[key] = Histogram(STATEMENT_BUCKETS)
+            self.db_time[key] = Histogram(LATENCY_BUCKETS)
+        latency.observe(seconds)
+        self.statements[key].observe(queries.statements)
+        self.db_time[key].observe(queries.seconds)
+
+    def observe_rate_limited(self, handler: str):
+        self.rate_limited[handler] += 1
+
+    def observe_unhandled_error(self, route: str, exception: Exception):
+        self.unhandled_errors[(route, type(exception).__name__)] += 1
+
+    def set_password_pool(self, in_flight: int, queued: int):
+        self.password_in_flight = in_flight
+        self.password_queued = queued
+
+    def observe_password(self, operation: str, wait: float, duration: float):
+        if operation not in self.password_wait:
+            self.password_wait[operation] = Histogram(LATENCY_BUCKETS)
+            self.password_duration[operation] = Histogram(LATENCY_BUCKETS)
+        self.password_wait[operation].observe(wait)
+        self.password_duration[operation].observe(duration)
+
+    def observe_password_rejected(self, operation: str):
+        self.password_rejected[operation] += 1
+
+    def observe_compression(self, encoding: str, raw_bytes: int, compressed_bytes: int, seconds: float):
+        self.compression_responses[encoding] += 1
+        self.compression_bytes_in[encoding] += raw_bytes
+        self.compression_bytes_out[encoding] += compressed_bytes
+        self.compression_seconds[encoding] += seconds
+
+    def reset(self):
+        self.__init__()
+
+    def render(self) -> str:
+        lines = []
+        metric(lines, "http_requests_in_flight", "gauge", "Requests being processed now",
+               [({}, self.in_flight)])
+        metric(lines, "http_requests_total", "counter", "Finished requests",
+               [({"method": m, "route": r, "status": s}, v) for (m, r, s), v in list(self.requests.items())])
+        histogram(lines, "http_request_duration_seconds", "Request latency by route template",
+                  [({"method": m, "route": r}, h) for (m, r), h in list(self.latency.items())])
+        histogram(lines, "db_statements_per_request", "SQL statements executed per request",
+                  [({"method": m, "route": r}, h) for (m, r), h in list(self.statements.items())])
+        histogram(lines, "db_time_per_request_seconds", "Time spent executing SQL per request",
+                  [({"method": m, "route": r}, h) for (m, r), h in list(self.db_time.items())])
+        metric(lines, "http_rate_limited_total", "counter", "Requests rejected by the rate limiter",
+               [({"handler": h}, v) for h, v in list(self.rate_limited.items())])
+        metric(lines, "http_unhandled_exceptions_total", "counter", "Unhandled exceptions answered with 500",
+               [({"route": r, "exception": e}, v) for (r, e), v in list(self.unhandled_errors.items())])
+        metric(lines, "password_hash_in_flight", "gauge", "Password hashes being computed now",
+               [({}, self.password_in_flight)])
+        metric(lines, "password_hash_queued", "gauge", "Password hashes waiting for a worker thread",
+               [({}, self.password_queued)])
+        histogram(lines, "password_hash_wait_seconds", "Time a password hash waited in the queue",
+                  [({"operation": o}, h) for o, h in list(self.password_wait.items())])
+        histogram(lines, "password_hash_duration_seconds", "Time to hash or verify a password",
+                  [({"operation": o}, h) for o, h in list(self.password_duration.items())])
+        metric(lines, "password_hash_rejected_total", "counter", "Password operations rejected with 503",
+               [({"operation": o}, v) for o, v in list(self.password_rejected.items())])
+        metric(lines, "http_compressed_responses_total", "counter", "Responses compressed by encoding",
+               [({"encoding": e}, v) for e, v in list(self.compression_responses.items())])
+        metric(lines, "http_compression_input_bytes_total", "counter", "Response bytes before compression",
+               [({"encoding": e}, v) for e, v in list(self.compression_bytes_in.items())])
+        metric(lines, "http_compression_output_bytes_total", "counter", "Response bytes after compression",
+               [({"encoding": e}, v) for e, v in list(self.compression_bytes_out.items())])
+        metric(lines, "http_compression_seconds_total", "counter", "CPU time spent compressing responses",
+               [({"encoding": e}, v) for e, v in list(self.compression_seconds.items())])
+        self.render_pool(lines)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def render_pool(lines: List[str]):
+        stats = get_pool_stats()
+        for name, key, help_text in (
+            ("db_pool_connects_total", "connects", "New DB connections opened"),
+            ("db_pool_checkouts_total", "checkouts", "Connections taken from the pool"),
+            ("db_pool_checkins_total", "checkins", "Connections returned to the pool"),
+            ("db_pool_invalidations_total", "invalidations", "Connections invalidated"),
+            ("db_pool_timeouts_total", "timeouts", "Checkouts that hit pool_timeout"),
+        ):
+            metric(lines, name, "counter", help_text, [({}, stats[key])])
+        lines.append("# HELP db_pool_checkout_wait_seconds Time spent waiting for a free connection")
+        lines.append("# TYPE db_pool_checkout_wait_seconds summary")
+        lines.append(f"db_pool_checkout_wait_seconds_count {stats['wait_count']}")
+        lines.append(f"db_pool_checkout_wait_seconds_sum {format_value(stats['wait_total_seconds'])}")
+        metric(lines, "db_pool_checkout_wait_max_seconds", "gauge", "Longest wait for a free connection",
+               [({}, stats["wait_max_seconds"])])
+        for name, key, help_text in (
+            ("db_pool_size", "size", "Configured pool size"),
+            ("db_pool_checked_out", "checked_out", "Connections in use"),
+            ("db_pool_checked_in", "checked_in", "Idle connections in the pool"),
+            ("db_pool_overflow", "overflow", "Connections opened above pool_size"),
+        ):
+            if key in stats:
+                metric(lines, name, "gauge", help_text, [({}, stats[key])])
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else f"{value:.1f}"
+    return str(value)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def metric(lines: List[str], name: str, kind: str, help_text: str, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+
+def histogram(lines: List[str], name: str, help_text: str, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, hist in samples:
+        for bound, count in hist.cumulative():
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {format_value(hist.sum)}")
+        lines.append(f"{name}_count{format_labels(labels)} {hist.count}")
+
+
+def route_template(scope) -> str:
+    # шаблон маршрута, а не сам путь: /notes/tg/{telegram_id}, а не /notes/tg/12345
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    Считает запросы в обработке, задержку, число SQL-выражений и время в БД по шаблону маршрута.
+    Чистая ASGI-мидлвара: тело ответа не буферизуется.
+    """
+
+    def __init__(self, app, registry: Optional[Metrics] = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        registry = self.registry
+        registry.in_flight += 1
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with track_queries() as queries:
+            try:
+                await self.app(scope, receive, send_with_status)
+            except Exception:
+                status_code = 500
+                raise
+            finally:
+                registry.in_flight -= 1
+                registry.observe_request(scope["method"], route_template(scope), status_code,
+                                         time.perf_counter() - start, queries)
+
+
+def before_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        if stats.log is not None:
+            stats.log.append(statement)
+        stats.started = time.perf_counter()
+
+
+def after_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = _query_stats.get()
+    if stats is not None and stats.started:
+        stats.seconds += time.perf_counter() - stats.started
+        stats.started = 0.0
+
+
+def instrument_engine(engine: Engine):
+    """
+    Подключает подсчет SQL-выражений запроса к движку. Для асинхронного движка передается его sync_engine:
+    SQLAlchemy выполняет события в том же контексте, что и корутина запроса, поэтому счетчик из ContextVar доступен.
+    """
+    for name, listener in (("before_cursor_execute", before_statement), ("after_cursor_execute", after_statement)):
+        if not event.contains(engine, name, listener):
+            event.listen(engine, name, listener)
+
+
+metrics = Metrics()
+instrument_engine(async_engine.sync_engine)
@@ -0,0 +1,26 @@
+"""notes user_id updated_at index
+
+Revision ID: 3d7f1b8e6c52
+Revises: 5b1f0c9d2a41
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d7f1b8e6c52'
+down_revision: Union[str, None] = '5b1f0c9d2a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_notes_user_id_updated_at_id', 'notes', ['user_id', 'updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notes_user_id_updated_at_id', table_name='notes')
@@ -0,0 +1,40 @@
+"""user tag stats
+
+Revision ID: a3f6b9d1c274
+Revises: e7a1d5c3f820
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f6b9d1c274'
+down_revision: Union[str, None] = 'e7a1d5c3f820'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_tag_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('note_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'tag_id')
+    )
+    # заполняем по уже существующим заметкам
+    op.execute(
+        "INSERT INTO user_tag_stats (user_id, tag_id, note_count) "
+        "SELECT notes.user_id, note_tags.tag_id, count(*) "
+        "FROM note_tags JOIN notes ON notes.id = note_tags.note_id "
+        "GROUP BY notes.user_id, note_tags.tag_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_tag_stats')
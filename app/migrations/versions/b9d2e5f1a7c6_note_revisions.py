@@ -0,0 +1,66 @@
+"""note revisions
+
+Revision ID: b9d2e5f1a7c6
+Revises: a3f6b9d1c274
+Create Date: 2026-10-18 19:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9d2e5f1a7c6'
+down_revision: Union[str, None] = 'a3f6b9d1c274'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('note_revisions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('revision', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.add_column('notes', sa.Column('revision', sa.BigInteger(), nullable=True))
+    op.add_column('deleted_notes', sa.Column('revision', sa.BigInteger(), nullable=True))
+    # нумеруем существующие изменения каждого пользователя: сначала заметки, затем удаления, каждые по времени
+    op.execute(
+        "UPDATE notes SET revision = numbered.revision "
+        "FROM (SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY updated_at, id) AS revision "
+        "FROM notes) AS numbered "
+        "WHERE notes.id = numbered.id"
+    )
+    op.execute(
+        "UPDATE deleted_notes SET revision = numbered.revision "
+        "FROM (SELECT note_id, row_number() OVER (PARTITION BY user_id ORDER BY deleted_at, note_id) "
+        "+ (SELECT count(*) FROM notes WHERE notes.user_id = deleted_notes.user_id) AS revision "
+        "FROM deleted_notes) AS numbered "
+        "WHERE deleted_notes.note_id = numbered.note_id"
+    )
+    op.execute(
+        "INSERT INTO note_revisions (user_id, revision) "
+        "SELECT user_id, max(revision) FROM ("
+        "SELECT user_id, revision FROM notes UNION ALL SELECT user_id, revision FROM deleted_notes"
+        ") AS revisions GROUP BY user_id"
+    )
+    op.alter_column('notes', 'revision', nullable=False)
+    op.alter_column('deleted_notes', 'revision', nullable=False)
+    op.create_index('ix_notes_user_id_revision_id', 'notes', ['user_id', 'revision', 'id'], unique=False)
+    op.drop_index('ix_deleted_notes_user_id_deleted_at', table_name='deleted_notes')
+    op.create_index('ix_deleted_notes_user_id_revision', 'deleted_notes', ['user_id', 'revision'], unique=False)
+    # ид удаленной заметки копируется из notes, последовательность, созданная для него как для SERIAL, не нужна
+    op.execute("ALTER TABLE deleted_notes ALTER COLUMN note_id DROP DEFAULT")
+    op.execute("DROP SEQUENCE IF EXISTS deleted_notes_note_id_seq")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_deleted_notes_user_id_revision', table_name='deleted_notes')
+    op.create_index('ix_deleted_notes_user_id_deleted_at', 'deleted_notes', ['user_id', 'deleted_at'], unique=False)
+    op.drop_index('ix_notes_user_id_revision_id', table_name='notes')
+    op.drop_column('deleted_notes', 'revision')
+    op.drop_column('notes', 'revision')
+    op.drop_table('note_revisions')
@@ -0,0 +1,26 @@
+"""note_tags tag_id index
+
+Revision ID: c4d8e2b6a913
+Revises: 9e3c7a1f4b82
+Create Date: 2026-10-18 10:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d8e2b6a913'
+down_revision: Union[str, None] = '9e3c7a1f4b82'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_note_tags_tag_id_note_id', 'note_tags', ['tag_id', 'note_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_note_tags_tag_id_note_id', table_name='note_tags')
@@ -0,0 +1,34 @@
+"""deleted notes
+
+Revision ID: e7a1d5c3f820
+Revises: c4d8e2b6a913
+Create Date: 2026-10-18 11:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a1d5c3f820'
+down_revision: Union[str, None] = 'c4d8e2b6a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('deleted_notes',
+    sa.Column('note_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('note_id')
+    )
+    op.create_index('ix_deleted_notes_user_id_deleted_at', 'deleted_notes', ['user_id', 'deleted_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_deleted_notes_user_id_deleted_at', table_name='deleted_notes')
+    op.drop_table('deleted_notes')
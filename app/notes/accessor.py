@@ -1,12 +1,21 @@
-from typing import List, Tuple
+from collections import Counter
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
 from fastapi import Depends
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, Select, String, and_, delete, func, insert, literal, or_, select, text, tuple_, union
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from database import get_async_session
-from notes.models import Note, Tag
-from notes.schemas import NoteCreate, NoteUpdate, TagSearch
+from notes.models import FTS_CONFIG, DeletedNote, Note, NoteRevision, NoteTag, Tag, UserTagStat
+from notes.pagination import DEFAULT_PAGE_SIZE, InvalidCursor, decode_cursor, decode_note_cursor, encode_cursor
+from notes.schemas import NoteBatch, NoteCreate, NoteUpdate, TagSearch
+from notes.cache import response_cache
+from notes.tag_index import tag_index
+
+
+EXPORT_BATCH_SIZE = 500
 
 
 # создаем класс, который служит прослойкой между БД и сервисным уровнем
@@ -15,62 +24,529 @@ class ContentManager:
         self.session = session
 
     async def create_note(self, note: NoteCreate, user_id: int) -> Note:
-        db_note = Note(
-            title=note.title,
-            content=note.content,
-            user_id=user_id,
+        """
+        Создаем заметку и связи с тегами в одной транзакции, число запросов не зависит от количества тегов:
+        INSERT заметки вместе с увеличением ревизии пользователя, один upsert всех тегов,
+        добор уже существующих тегов, массовая вставка связей и обновление счетчиков тегов
+        """
+        revision = self._revision_upsert(user_id).cte("revision")
+        db_note = await self.session.scalar(
+            insert(Note)
+            .from_select(["title", "content", "user_id", "revision"],
+                         select(literal(note.title, String), literal(note.content, String), literal(user_id),
+                                revision.c.revision))
+            .add_cte(revision)
+            .returning(Note)
         )
-        self.session.add(db_note)
-        await self.session.commit()
 
-        # добавляем связи many-to-many между заметками и тегами
-        for tag_name in note.tags:
-            result = await self.session.execute(
-                select(Tag).where(Tag.name == tag_name)
+        tags = await self._upsert_tags(note.tags)
+        if tags:
+            await self.session.execute(
+                insert(NoteTag).values([{"note_id": db_note.id, "tag_id": tag.id} for tag in tags])
             )
-            tag = result.scalars().first()
-
-            if not tag:
-                tag = Tag(name=tag_name)
-                self.session.add(tag)
-                await self.session.commit()
-
-            await self.session.refresh(db_note)
-            db_note.tags.append(tag)
+        # коллекция уже известна, повторно читать ее из БД не нужно
+        set_committed_value(db_note, "tags", tags)
+        await self._update_tag_stats(user_id, added=tags)
 
         await self.session.commit()
-        await self.session.refresh(db_note)
+        tag_index.apply(user_id, added=[tag.name for tag in tags])
+        await response_cache.invalidate(user_id)
         return db_note
 
+    @staticmethod
+    def _revision_upsert(user_id: int):
+        """
+        Увеличивает счетчик изменений пользователя и возвращает новую ревизию. Строка счетчика остается
+        заблокированной до конца транзакции, поэтому его увеличивают первым запросом транзакции,
+        до блокировок тегов и счетчиков тегов - так параллельные транзакции не блокируют друг друга по кругу.
+        """
+        upsert = pg_insert(NoteRevision).values(user_id=user_id, revision=1)
+        return upsert.on_conflict_do_update(
+            index_elements=[NoteRevision.user_id],
+            set_={"revision": NoteRevision.revision + 1},
+        ).returning(NoteRevision.revision)
+
+    async def _next_revision(self, user_id: int) -> int:
+        return await self.session.scalar(self._revision_upsert(user_id))
+
+    async def _upsert_tags(self, tag_names: List[str]) -> List[Tag]:
+        """
+        Возвращает теги с указанными именами, создавая недостающие.
+        ON CONFLICT DO NOTHING не падает, если тот же тег параллельно создает другой запрос,
+        такие теги (как и уже существующие) дочитываются отдельным запросом.
+        Теги вставляются в отсортированном порядке, чтобы параллельные транзакции не блокировали друг друга.
+        """
+        names = list(dict.fromkeys(tag_names))
+        if not names:
+            return []
+
+        inserted = await self.session.scalars(
+            pg_insert(Tag)
+            .values([{"name": name} for name in sorted(names)])
+            .on_conflict_do_nothing(index_elements=[Tag.name])
+            .returning(Tag)
+        )
+        tags = {tag.name: tag for tag in inserted}
+
+        missing = [name for name in names if name not in tags]
+        if missing:
+            existing = await self.session.scalars(
+                select(Tag).where(Tag.name.in_(missing))
+            )
+            tags.update({tag.name: tag for tag in existing})
+
+        return [tags[name] for name in names]
+
     async def get_note_by_id(self, note_id: int) -> Note:
-        return await self.session.get(Note, note_id)
+        # теги нужны для ответа и для сравнения при изменении, заметки самих тегов - нет
+        return await self.session.get(Note, note_id, options=[selectinload(Note.tags)])
+
+    async def get_notes_by_user_id(self, user_id: int,
+                                   limit: int = DEFAULT_PAGE_SIZE,
+                                   cursor: Optional[str] = None) -> Tuple[List[Row], Optional[str]]:
+        query = self._note_rows().where(Note.user_id == user_id)
+        return await self._fetch_page(query, limit, cursor)
 
-    async def get_notes_by_user_id(self, user_id: int) -> List[Note]:
-        notes = await self.session.execute(select(Note)
-                                           .where(Note.user_id == user_id)
-                                           )
-        return notes.scalars().all()
+    @staticmethod
+    def _note_rows() -> Select:
+        """
+        Запрос строк для списков: только нужные колонки и имена тегов, собранные в массив в самом запросе.
+        Объекты Note не создаются и не попадают в identity map, теги не дочитываются отдельным запросом.
+        Строки результата: id, title, content, created_at, updated_at, tags (None, если тегов нет).
+        """
+        tags = (select(func.array_agg(aggregate_order_by(Tag.name, Tag.name)))
+                .join_from(NoteTag, Tag, Tag.id == NoteTag.tag_id)
+                .where(NoteTag.note_id == Note.id)
+                .scalar_subquery())
+        return select(Note.id, Note.title, Note.content, Note.created_at, Note.updated_at, tags.label("tags"))
 
     async def update_note(self, note_id, note: NoteUpdate, user_id: int) -> Note:
         db_note = await self.get_note_by_id(note_id)
         assert db_note.user_id == user_id  # user can check only their notes
+        db_note.revision = await self._next_revision(user_id)
         if note.title:
             db_note.title = note.title
         if note.content:
             db_note.content = note.content
+        added, removed = [], []
+        if note.tags:
+            added, removed = await self._replace_tags(db_note, note.tags)
         await self.session.commit()
+        tag_index.apply(user_id, added=added, removed=removed)
+        await response_cache.invalidate(user_id)
         return db_note
 
+    async def _replace_tags(self, db_note: Note, tag_names: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Приводит теги заметки к переданному списку, меняя только отличающиеся связи.
+        Возвращает имена добавленных и удаленных тегов.
+        """
+        current = {tag.name for tag in db_note.tags}
+        new_tags = await self._upsert_tags([name for name in tag_names if name not in current])
+        added, removed = self._diff_tags(db_note, tag_names, {tag.name: tag for tag in new_tags})
+        await self._relink_tags([(db_note.id, tag.id) for tag in added], [(db_note.id, tag.id) for tag in removed])
+        await self._update_tag_stats(db_note.user_id, added=added, removed=removed)
+        return [tag.name for tag in added], [tag.name for tag in removed]
+
+    @staticmethod
+    def _diff_tags(db_note: Note, tag_names: List[str], tags_by_name: Dict[str, Tag]) -> Tuple[List[Tag], List[Tag]]:
+        """
+        Приводит коллекцию тегов заметки в памяти к переданному списку и возвращает добавленные
+        и удаленные теги, связи в БД меняет вызывающий код. В tags_by_name должны быть все теги,
+        которых у заметки еще нет.
+        """
+        names = list(dict.fromkeys(tag_names))
+        current = {tag.name: tag for tag in db_note.tags}
+        added = [tags_by_name[name] for name in names if name not in current]
+        removed = [tag for name, tag in current.items() if name not in set(names)]
+        if added or removed:
+            set_committed_value(db_note, "tags", [current.get(name) or tags_by_name[name] for name in names])
+            # смена тегов - тоже изменение заметки
+            db_note.updated_at = func.now()
+        return added, removed
+
+    async def _relink_tags(self, added: List[Tuple[int, int]], removed: List[Tuple[int, int]]):
+        """
+        Удаляет и добавляет связи (note_id, tag_id) двумя запросами независимо от их количества
+        """
+        if removed:
+            await self.session.execute(
+                delete(NoteTag).where(tuple_(NoteTag.note_id, NoteTag.tag_id).in_(removed))
+            )
+        if added:
+            await self.session.execute(
+                insert(NoteTag).values([{"note_id": note_id, "tag_id": tag_id} for note_id, tag_id in added])
+            )
+
+    async def _update_tag_stats(self, user_id: int, added: Iterable[Tag] = (), removed: Iterable[Tag] = ()):
+        """
+        Меняет счетчики user_tag_stats на число добавленных и удаленных связей заметок пользователя с тегами.
+        Не больше двух запросов: upsert с приращением и удаление счетчиков, дошедших до нуля.
+        Строки меняются в порядке tag_id, чтобы параллельные транзакции не блокировали друг друга.
+        """
+        deltas = Counter(tag.id for tag in added)
+        deltas.subtract(tag.id for tag in removed)
+        deltas = {tag_id: delta for tag_id, delta in sorted(deltas.items()) if delta}
+        if not deltas:
+            return
+
+        upsert = pg_insert(UserTagStat).values(
+            [{"user_id": user_id, "tag_id": tag_id, "note_count": delta} for tag_id, delta in deltas.items()]
+        )
+        await self.session.execute(upsert.on_conflict_do_update(
+            index_elements=[UserTagStat.user_id, UserTagStat.tag_id],
+            set_={"note_count": UserTagStat.note_count + upsert.excluded.note_count},
+        ))
+        decreased = [tag_id for tag_id, delta in deltas.items() if delta < 0]
+        if decreased:
+            await self.session.execute(
+                delete(UserTagStat)
+                .where(UserTagStat.user_id == user_id)
+                .where(UserTagStat.tag_id.in_(decreased))
+                .where(UserTagStat.note_count <= 0)
+            )
+
+    async def apply_batch(self, batch: NoteBatch,
+                          user_id: int) -> Tuple[List[Note], List[Optional[Note]], List[bool]]:
+        """
+        Создает, изменяет и удаляет заметки пачкой в одной транзакции.
+        Число запросов не зависит от размера пачки: один upsert всех тегов, массовая вставка заметок
+        с RETURNING, одно чтение изменяемых и удаляемых заметок, по одному запросу на вставку
+        и удаление связей, удаление заметок и запись об удалении.
+        Чужие и несуществующие заметки не прерывают пачку, для них возвращается None/False.
+        :return: созданные заметки, измененные заметки и признаки удаления - в порядке элементов пачки
+        """
+        revision = await self._next_revision(user_id)
+        tags_by_name = {tag.name: tag for tag in await self._upsert_tags(
+            [name for item in (*batch.create, *batch.update) for name in item.tags]
+        )}
+
+        existing = {}
+        target_ids = [item.id for item in batch.update] + batch.delete
+        if target_ids:
+            existing = {note.id: note for note in await self.session.scalars(
+                select(Note).where(Note.id.in_(target_ids)).where(Note.user_id == user_id)
+                .options(selectinload(Note.tags))
+            )}
+
+        created = []
+        if batch.create:
+            created = list(await self.session.scalars(
+                insert(Note).returning(Note, sort_by_parameter_order=True),
+                [{"title": item.title, "content": item.content, "user_id": user_id, "revision": revision}
+                 for item in batch.create],
+            ))
+            for db_note, item in zip(created, batch.create):
+                set_committed_value(db_note, "tags", [tags_by_name[name] for name in dict.fromkeys(item.tags)])
+
+        links_added = [(db_note.id, tag.id) for db_note in created for tag in db_note.tags]
+        links_removed = []
+        tags_added = [tag for db_note in created for tag in db_note.tags]
+        tags_removed = []
+
+        updated = []
+        for item in batch.update:
+            db_note = existing.get(item.id)
+            updated.append(db_note)
+            if db_note is None:
+                continue
+            db_note.revision = revision
+            if item.title:
+                db_note.title = item.title
+            if item.content:
+                db_note.content = item.content
+            if item.tags:
+                added, removed = self._diff_tags(db_note, item.tags, tags_by_name)
+                links_added += [(db_note.id, tag.id) for tag in added]
+                links_removed += [(db_note.id, tag.id) for tag in removed]
+                tags_added += added
+                tags_removed += removed
+        await self._relink_tags(links_added, links_removed)
+        # изменения заметок должны попасть в БД до их удаления ниже
+        await self.session.flush()
+
+        deleted_notes = [existing[note_id] for note_id in dict.fromkeys(batch.delete) if note_id in existing]
+        if deleted_notes:
+            deleted_ids = [db_note.id for db_note in deleted_notes]
+            tags_removed += [tag for db_note in deleted_notes for tag in db_note.tags]
+            await self.session.execute(delete(NoteTag).where(NoteTag.note_id.in_(deleted_ids)))
+            await self.session.execute(delete(Note).where(Note.id.in_(deleted_ids)))
+            await self.session.execute(
+                insert(DeletedNote).values([{"note_id": note_id, "user_id": user_id, "revision": revision}
+                                            for note_id in deleted_ids])
+            )
+            for db_note in deleted_notes:
+                self.session.expunge(db_note)
+        await self._update_tag_stats(user_id, added=tags_added, removed=tags_removed)
+
+        await self.session.commit()
+        tag_index.apply(user_id, added=[tag.name for tag in tags_added], removed=[tag.name for tag in tags_removed])
+        await response_cache.invalidate(user_id)
+        deleted_ids = {db_note.id for db_note in deleted_notes}
+        return created, updated, [note_id in deleted_ids for note_id in batch.delete]
+
     async def delete_note(self, note_id: int, user_id: int):
         db_note = await self.get_note_by_id(note_id)
         assert db_note.user_id == user_id  # user can delete only their notes
+        revision = await self._next_revision(user_id)
+        tags = list(db_note.tags)
         await self.session.delete(db_note)
+        # в той же транзакции запоминаем удаление для синхронизации клиентов
+        self.session.add(DeletedNote(note_id=db_note.id, user_id=user_id, revision=revision))
+        await self._update_tag_stats(user_id, removed=tags)
         await self.session.commit()
+        tag_index.apply(user_id, removed=[tag.name for tag in tags])
+        await response_cache.invalidate(user_id)
         return
 
-    async def get_notes_by_tag(self, tag_search: str, user_id: int) -> List[Note] | None:
-        notes = await self.session.execute(select(Note)
-                                           .join(Note.tags)
-                                           .filter(Tag.name == tag_search)
-                                           .filter(Note.user_id == user_id))
-        return notes.scalars().all()
+    async def autocomplete_tags(self, user_id: int, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """
+        Теги пользователя, начинающиеся с prefix, по убыванию числа заметок.
+        Отвечает из индекса в памяти, в БД идет только при первом обращении к пользователю
+        и читает готовые счетчики из user_tag_stats.
+        """
+        user_tags = tag_index.get(user_id)
+        if user_tags is None:
+            generation = tag_index.begin_load(user_id)
+            counts = None
+            try:
+                rows = await self.session.execute(
+                    select(Tag.name, UserTagStat.note_count)
+                    .join_from(UserTagStat, Tag, Tag.id == UserTagStat.tag_id)
+                    .where(UserTagStat.user_id == user_id)
+                )
+                counts = dict(rows.all())
+            finally:
+                user_tags = tag_index.finish_load(user_id, generation, counts)
+        return user_tags.complete(prefix, limit)
+
+    async def get_tag_stats(self, user_id: int,
+                            limit: int = DEFAULT_PAGE_SIZE,
+                            cursor: Optional[str] = None) -> Tuple[List[Row], Optional[str]]:
+        """
+        Облако тегов: теги пользователя с числом заметок, от частых к редким, при равенстве - по имени.
+        Читает только строки user_tag_stats пользователя, стоимость не зависит от числа заметок.
+        Курсор - (note_count, name) последнего тега страницы.
+        """
+        query = (select(Tag.name, UserTagStat.note_count)
+                 .join_from(UserTagStat, Tag, Tag.id == UserTagStat.tag_id)
+                 .where(UserTagStat.user_id == user_id))
+        if cursor:
+            try:
+                last_count, last_name = decode_cursor(cursor)
+                last_count, last_name = int(last_count), str(last_name)
+            except (TypeError, ValueError):
+                raise InvalidCursor(cursor)
+            query = query.where(or_(UserTagStat.note_count < last_count,
+                                    and_(UserTagStat.note_count == last_count, Tag.name > last_name)))
+        query = query.order_by(UserTagStat.note_count.desc(), Tag.name).limit(limit + 1)
+
+        rows = (await self.session.execute(query)).all()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].note_count, rows[-1].name)
+
+    async def rebuild_tag_stats(self, user_id: int) -> int:
+        """
+        Пересчитывает счетчики user_tag_stats пользователя по note_tags и исправляет расхождения.
+        На время пересчета таблица блокируется от изменений: запись заметок, начатая раньше,
+        успевает завершиться и попадает в подсчет, начатая позже ждет и применяет свое приращение
+        уже к пересчитанным значениям. Блокировка короткая - пересчет идет по одному пользователю.
+        :return: сколько счетчиков было исправлено
+        """
+        await self.session.execute(text("LOCK TABLE user_tag_stats IN SHARE ROW EXCLUSIVE MODE"))
+        stored = dict((await self.session.execute(
+            select(UserTagStat.tag_id, UserTagStat.note_count).where(UserTagStat.user_id == user_id)
+        )).all())
+        actual = dict((await self.session.execute(
+            select(NoteTag.tag_id, func.count())
+            .join(Note, Note.id == NoteTag.note_id)
+            .where(Note.user_id == user_id)
+            .group_by(NoteTag.tag_id)
+        )).all())
+
+        stale = [tag_id for tag_id in stored if tag_id not in actual]
+        if stale:
+            await self.session.execute(
+                delete(UserTagStat).where(UserTagStat.user_id == user_id).where(UserTagStat.tag_id.in_(stale))
+            )
+        changed = {tag_id: count for tag_id, count in actual.items() if stored.get(tag_id) != count}
+        if changed:
+            upsert = pg_insert(UserTagStat).values(
+                [{"user_id": user_id, "tag_id": tag_id, "note_count": count} for tag_id, count in sorted(changed.items())]
+            )
+            await self.session.execute(upsert.on_conflict_do_update(
+                index_elements=[UserTagStat.user_id, UserTagStat.tag_id],
+                set_={"note_count": upsert.excluded.note_count},
+            ))
+        await self.session.commit()
+        if stale or changed:
+            tag_index.invalidate(user_id)
+        return len(stale) + len(changed)
+
+    async def get_users_for_tag_stats(self) -> List[int]:
+        """
+        Пользователи, у которых есть заметки или счетчики тегов, - кого проверять при полной пересборке
+        """
+        rows = await self.session.scalars(
+            union(select(Note.user_id), select(UserTagStat.user_id)).order_by("user_id")
+        )
+        return list(rows)
+
+    async def get_notes_by_tags(self, user_id: int,
+                                all_tags: List[str] = (),
+                                any_tags: List[str] = (),
+                                exclude_tags: List[str] = (),
+                                limit: int = DEFAULT_PAGE_SIZE,
+                                cursor: Optional[str] = None) -> Tuple[List[Row], Optional[str]]:
+        """
+        Поиск по набору тегов одним запросом: заметка должна содержать все теги из all_tags,
+        хотя бы один из any_tags и ни одного из exclude_tags.
+        Каждое условие - подзапрос по note_tags, связанный с заметкой внешнего запроса: проверяются только
+        заметки пользователя по первичному ключу (note_id, tag_id), а не все заметки с тегом у всех пользователей.
+        Для all_tags совпадения считаются через count, any_tags - EXISTS, exclude_tags - anti-join через NOT EXISTS.
+        """
+        query = self._note_rows().where(Note.user_id == user_id)
+
+        all_tags = list(dict.fromkeys(all_tags))
+        if all_tags:
+            query = query.where(
+                self._note_tags_matching(all_tags).with_only_columns(func.count()).scalar_subquery() == len(all_tags)
+            )
+        if any_tags:
+            query = query.where(self._note_tags_matching(any_tags).exists())
+        if exclude_tags:
+            query = query.where(~self._note_tags_matching(exclude_tags).exists())
+
+        return await self._fetch_page(query, limit, cursor)
+
+    @staticmethod
+    def _note_tags_matching(tag_names: List[str]) -> Select:
+        return (select(NoteTag.note_id)
+                .join(Tag, Tag.id == NoteTag.tag_id)
+                .where(NoteTag.note_id == Note.id, Tag.name.in_(tag_names)))
+
+    async def search_notes(self, text: str, user_id: int,
+                           limit: int = DEFAULT_PAGE_SIZE,
+                           cursor: Optional[str] = None) -> Tuple[List[Row], Optional[str]]:
+        """
+        Полнотекстовый поиск по заголовку и содержимому через GIN-индекс на search_vector.
+        Результаты упорядочены по релевантности, курсор - (rank, id) последней заметки страницы.
+        """
+        ts_query = func.websearch_to_tsquery(FTS_CONFIG, text)
+        rank = func.ts_rank_cd(Note.search_vector, ts_query)
+        query = (self._note_rows().add_columns(rank.label("rank"))
+                 .where(Note.user_id == user_id)
+                 .where(Note.search_vector.bool_op("@@")(ts_query)))
+        if cursor:
+            try:
+                last_rank, last_id = decode_cursor(cursor)
+                last_rank, last_id = float(last_rank), int(last_id)
+            except (TypeError, ValueError):
+                raise InvalidCursor(cursor)
+            query = query.where(tuple_(rank, Note.id) < tuple_(last_rank, last_id))
+        query = query.order_by(rank.desc(), Note.id.desc()).limit(limit + 1)
+
+        rows = (await self.session.execute(query)).all()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].rank, rows[-1].id)
+
+    async def get_notes_revision(self, user_id: int) -> int:
+        """
+        Ревизия заметок пользователя для ETag: меняется при каждом создании, изменении и удалении заметок
+        и видна только после коммита изменившей ее транзакции. Чтение одной строки по первичному ключу.
+        """
+        revision = await self.session.scalar(select(NoteRevision.revision).where(NoteRevision.user_id == user_id))
+        return revision or 0
+
+    async def get_changes(self, user_id: int, since: int,
+                          limit: int = DEFAULT_PAGE_SIZE,
+                          cursor: Optional[str] = None) -> Tuple[List[Note], List[int], Optional[str], int]:
+        """
+        Изменения для инкрементальной синхронизации: заметки, созданные или измененные после ревизии since,
+        в порядке ревизий, и ид заметок, удаленных после since (только на первой странице).
+        Курсор - (revision, id) последней заметки страницы и отметка синхронизации.
+        Отметка - самая поздняя из увиденных ревизий, ее клиент передает как since в следующий раз.
+        Ревизии выдаются в порядке коммитов, поэтому изменение, закоммиченное позже, не может получить
+        ревизию не больше отметки и потеряться.
+        :return: заметки, ид удаленных заметок, курсор следующей страницы, отметка синхронизации
+        """
+        query = select(Note).where(Note.user_id == user_id).options(selectinload(Note.tags))
+        deleted = []
+        if cursor:
+            try:
+                revision, note_id, watermark = (int(value) for value in decode_cursor(cursor))
+            except (TypeError, ValueError):
+                raise InvalidCursor(cursor)
+            query = query.where(tuple_(Note.revision, Note.id) > tuple_(revision, note_id))
+        else:
+            watermark = since
+            query = query.where(Note.revision > since)
+            rows = await self.session.execute(
+                select(DeletedNote.note_id, DeletedNote.revision)
+                .where(DeletedNote.user_id == user_id)
+                .where(DeletedNote.revision > since)
+            )
+            for note_id, revision in rows:
+                deleted.append(note_id)
+                watermark = max(watermark, revision)
+
+        query = query.order_by(Note.revision, Note.id).limit(limit + 1)
+        notes = (await self.session.scalars(query)).all()
+        has_next = len(notes) > limit
+        notes = notes[:limit]
+        if notes:
+            watermark = max(watermark, notes[-1].revision)
+        next_cursor = encode_cursor(notes[-1].revision, notes[-1].id, watermark) if has_next else None
+        return notes, deleted, next_cursor, watermark
+
+    async def export_notes(self, user_id: int,
+                           batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Tuple[Note, List[str]]]]:
+        """
+        Выгружает все заметки пользователя пачками через серверный курсор.
+        Теги дочитываются одним запросом на пачку, после обработки пачки identity map очищается,
+        поэтому потребление памяти не зависит от количества заметок.
+        """
+        result = await self.session.stream_scalars(
+            select(Note)
+            .where(Note.user_id == user_id)
+            .order_by(Note.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for notes in result.partitions():
+            tags = await self._get_tag_names([note.id for note in notes])
+            yield [(note, tags.get(note.id, [])) for note in notes]
+            for note in notes:
+                self.session.expunge(note)
+
+    async def _get_tag_names(self, note_ids: List[int]) -> Dict[int, List[str]]:
+        rows = await self.session.execute(
+            select(NoteTag.note_id, Tag.name)
+            .join(Tag, Tag.id == NoteTag.tag_id)
+            .where(NoteTag.note_id.in_(note_ids))
+        )
+        tags = {}
+        for note_id, name in rows:
+            tags.setdefault(note_id, []).append(name)
+        return tags
+
+    async def _fetch_page(self, query: Select, limit: int,
+                          cursor: Optional[str]) -> Tuple[List[Row], Optional[str]]:
+        """
+        Keyset-пагинация по (updated_at, id) от новых заметок к старым: следующая страница
+        начинается сразу после последней заметки предыдущей, OFFSET не используется.
+        Запрашиваем на одну заметку больше, чтобы понять, есть ли следующая страница.
+        """
+        if cursor:
+            updated_at, note_id = decode_note_cursor(cursor)
+            query = query.where(tuple_(Note.updated_at, Note.id) < tuple_(updated_at, note_id))
+        query = query.order_by(Note.updated_at.desc(), Note.id.desc()).limit(limit + 1)
+
+        rows = (await self.session.execute(query)).all()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].updated_at, rows[-1].id)
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import settings
+
+
+class CacheBackend(ABC):
+    """
+    Хранилище для кэша ответов. Значения - готовые байты ответа, счетчики - версии данных пользователей.
+    Реализация в памяти работает в пределах одного процесса; чтобы несколько воркеров uvicorn
+    делили кэш, достаточно реализовать этот интерфейс поверх общего хранилища (например, Redis: GET/SET EX/INCR).
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float):
+        ...
+
+    @abstractmethod
+    async def get_counter(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str) -> int:
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """
+    LRU в памяти процесса, ограниченный суммарным размером значений в байтах.
+    Счетчики хранятся отдельно и не вытесняются: сброс версии в 0 мог бы снова открыть старые записи.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data: OrderedDict[str, Tuple[bytes, float]] = OrderedDict()
+        self._counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] < time.monotonic():
+            self._pop(key)
+            return None
+        self._data.move_to_end(key)
+        return item[0]
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        self._pop(key)
+        self._data[key] = (value, time.monotonic() + ttl)
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    async def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    def stats(self) -> dict:
+        return {"evictions": self.evictions, "entries": len(self._data),
+                "size_bytes": self.size, "max_bytes": self.max_bytes}
+
+    def _pop(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= len(item[0])
+
+
+class ResponseCache:
+    """
+    Кэш ответов на чтение заметок. В ключ входят пользователь, номер версии его данных и параметры запроса.
+    ContentManager увеличивает версию после каждого коммита, меняющего заметки пользователя,
+    поэтому инвалидация - один incr, а записи со старой версией больше не читаются и уходят по LRU.
+    Версия увеличивается после коммита: запрос, прочитавший старые данные, сохранит их под старой версией.
+    ttl ограничивает время жизни записи, если версию изменил другой процесс со своим кэшем в памяти.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float, enabled: bool = True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    async def key(self, user_id: int, query: Tuple) -> str:
+        """
+        Ключ записи для текущей версии данных пользователя. Ключ вычисляется один раз до чтения из БД:
+        если версия изменится, пока строится ответ, он будет сохранен под старой версией.
+        :param query: параметры запроса, сериализуемые в json, например ("notes", limit, cursor)
+        """
+        version = await self.backend.get_counter(self._version_key(user_id))
+        digest = hashlib.sha1(json.dumps(query, default=str).encode()).hexdigest()
+        return f"notes:{user_id}:{version}:{digest}"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes):
+        if self.enabled:
+            await self.backend.set(key, value, self.ttl)
+
+    async def invalidate(self, user_id: int):
+        await self.backend.incr(self._version_key(user_id))
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses, **self.backend.stats()}
+
+    @staticmethod
+    def _version_key(user_id: int) -> str:
+        return f"notes-version:{user_id}"
+
+
+def make_etag(*parts) -> str:
+    """
+    Слабый ETag из значений, однозначно описывающих состояние данных и параметры запроса
+    """
+    return 'W/"' + hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Слабое сравнение из RFC 9110: If-None-Match может содержать список тегов или *
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    value = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == value for tag in if_none_match.split(","))
+
+
+response_cache = ResponseCache(MemoryBackend(max_bytes=settings.RESPONSE_CACHE_MAX_BYTES),
+                               ttl=settings.RESPONSE_CACHE_TTL,
+                               enabled=settings.RESPONSE_CACHE_ENABLED)
@@ -1,8 +1,12 @@
-from sqlalchemy import ForeignKey, Integer, String, DateTime, func
+from sqlalchemy import BigInteger, Computed, ForeignKey, Integer, String, DateTime, Index, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 from database import Base
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
+# конфигурация полнотекстового поиска без стемминга: заметки пишутся и на русском, и на английском
+FTS_CONFIG = "simple"
+
 
 # заметка, временнЫе поля будут заполняться сервером БД автоматически
 class Note(Base):
@@ -14,9 +18,61 @@ class Note(Base):
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     created_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     updated_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=True)
+    # ревизия транзакции, которая последней меняла заметку (см. NoteRevision)
+    revision: Mapped[int] = mapped_column(BigInteger)
+    # поисковый вектор поддерживает сам Postgres, заголовок весит больше содержимого
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(
+            f"setweight(to_tsvector('{FTS_CONFIG}', coalesce(title, '')), 'A') || "
+            f"setweight(to_tsvector('{FTS_CONFIG}', coalesce(content, '')), 'B')",
+            persisted=True,
+        ),
+        nullable=True,
+        deferred=True,
+    )
 
     user: Mapped["User"] = relationship("User", back_populates="notes")
-    tags: Mapped[list["Tag"]] = relationship("Tag", secondary="note_tags", back_populates="notes", lazy='selectin')
+    # связи не загружаются неявно: каждый запрос в ContentManager сам указывает, что ему нужно (selectinload),
+    # а случайное обращение к незагруженной коллекции падает сразу, а не уходит в БД
+    tags: Mapped[list["Tag"]] = relationship("Tag", secondary="note_tags", back_populates="notes", lazy='raise')
+
+    # updated_at выставляет сервер, забираем новое значение сразу через RETURNING
+    __mapper_args__ = {"eager_defaults": True}
+
+    # индексы под keyset-пагинацию списка заметок пользователя, синхронизацию и полнотекстовый поиск
+    __table_args__ = (
+        Index("ix_notes_user_id_updated_at_id", "user_id", "updated_at", "id"),
+        Index("ix_notes_user_id_revision_id", "user_id", "revision", "id"),
+        Index("ix_notes_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+
+# удаленные заметки: по ним клиенты при синхронизации узнают, какие заметки убрать у себя
+class DeletedNote(Base):
+    __tablename__ = "deleted_notes"
+
+    # ид копируется из удаленной заметки, своей последовательности у таблицы нет
+    note_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    deleted_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    revision: Mapped[int] = mapped_column(BigInteger)
+
+    __table_args__ = (
+        Index("ix_deleted_notes_user_id_revision", "user_id", "revision"),
+    )
+
+
+# счетчик изменений заметок пользователя. Каждая транзакция, меняющая заметки, увеличивает его
+# и помечает новым значением свои заметки и записи об удалении. Строка счетчика заблокирована до коммита,
+# поэтому транзакции одного пользователя получают ревизии в порядке коммитов: в отличие от now()
+# (времени начала транзакции) ревизия не может закоммититься меньше уже видимой.
+# На ней построены ETag списков и курсор синхронизации
+class NoteRevision(Base):
+    __tablename__ = "note_revisions"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    revision: Mapped[int] = mapped_column(BigInteger)
 
 
 class Tag(Base):
@@ -25,7 +81,8 @@ class Tag(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String, unique=True)
 
-    notes: Mapped[list["Note"]] = relationship("Note", secondary="note_tags", back_populates="tags", lazy='selectin')
+    # заметки тега бывают у всех пользователей сразу, их не загружаем никогда - только через запросы по note_tags
+    notes: Mapped[list["Note"]] = relationship("Note", secondary="note_tags", back_populates="tags", lazy='raise')
 
 
 # таблица для связей many-to-many
@@ -35,3 +92,18 @@ class NoteTag(Base):
     note_id: Mapped[int] = mapped_column(ForeignKey('notes.id'), primary_key=True)
     tag_id: Mapped[int] = mapped_column(ForeignKey('tags.id'), primary_key=True)
 
+    # первичный ключ начинается с note_id, для поиска заметок по тегу нужен обратный порядок
+    __table_args__ = (
+        Index("ix_note_tags_tag_id_note_id", "tag_id", "note_id"),
+    )
+
+
+# сколько заметок пользователя отмечено тегом: облако тегов читается отсюда за O(тегов пользователя),
+# а не подсчетом по note_tags. Обновляется ContentManager в той же транзакции, что и заметки
+class UserTagStat(Base):
+    __tablename__ = "user_tag_stats"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    tag_id: Mapped[int] = mapped_column(ForeignKey("tags.id"), primary_key=True)
+    note_count: Mapped[int] = mapped_column(Integer)
+
@@ -0,0 +1,50 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+"""
+Курсор для keyset-пагинации - непрозрачная для клиента строка, в которой закодированы
+значения ключа сортировки последней отданной записи. Следующая страница начинается строго после них,
+поэтому ее стоимость не зависит от того, насколько глубоко пролистал клиент.
+"""
+
+
+def encode_cursor(*values) -> str:
+    payload = json.dumps(
+        [value.isoformat() if isinstance(value, datetime) else value for value in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def decode_note_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Курсор заметок: (updated_at, id) последней заметки на странице
+    """
+    values = decode_cursor(cursor)
+    try:
+        updated_at, note_id = values
+        return datetime.fromisoformat(updated_at), int(note_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
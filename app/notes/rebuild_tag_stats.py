@@ -0,0 +1,44 @@
+"""
+Пересборка счетчиков user_tag_stats по note_tags, если они разошлись с заметками
+(например, после ручных правок в БД). Пользователи обрабатываются по одному в отдельных транзакциях,
+приложение можно не останавливать. Запуск из папки app:
+
+    python -m notes.rebuild_tag_stats              # все пользователи
+    python -m notes.rebuild_tag_stats --user-id 42
+"""
+import argparse
+import asyncio
+
+from loguru import logger
+
+from database import async_engine, async_session_maker
+from notes.accessor import ContentManager
+
+
+async def rebuild(user_ids: list[int]) -> int:
+    if not user_ids:
+        async with async_session_maker() as session:
+            user_ids = await ContentManager(session).get_users_for_tag_stats()
+
+    fixed = 0
+    for user_id in user_ids:
+        async with async_session_maker() as session:
+            user_fixed = await ContentManager(session).rebuild_tag_stats(user_id)
+        if user_fixed:
+            logger.warning(f"Tag stats drift fixed: User: {user_id}, counters: {user_fixed}")
+        fixed += user_fixed
+    logger.info(f"Tag stats rebuilt for {len(user_ids)} users, fixed counters: {fixed}")
+    return fixed
+
+
+async def main(args):
+    try:
+        await rebuild(args.user_id)
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, action="append", default=[], help="rebuild only these users")
+    asyncio.run(main(parser.parse_args()))
@@ -1,12 +1,19 @@
-from typing import List
+from typing import Awaitable, Callable, Optional
 
-from fastapi import APIRouter, Depends, Request
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from loguru import logger
 from starlette import status
 
+from database import async_session_maker
+
 from limiter import limiter
 from notes.accessor import ContentManager
-from notes.schemas import NoteCreate, TagSearch, NoteUpdate, NoteResponse
+from notes.cache import etag_matches, make_etag, response_cache
+from notes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor
+from notes.schemas import NoteCreate, NoteUpdate, NoteResponse, NotePage, NoteSearchPage, \
+    TagSuggestion, TagPage, NoteChanges, NoteBatch, NoteBatchResult, NoteBatchResponse
 from users.auth import current_user
 from users.manager import get_user_manager, UserManager
 from users.models import User
@@ -26,6 +33,158 @@ router = APIRouter(
 Хэндлеры логируются, в.т.ч. ловятся ошибки. Пользователю сообщается об ошибке. 
 """
 
+MAX_SEARCH_TAGS = 20
+
+
+class TagFilter:
+    """
+    Параметры поиска по тегам: ?all=a&all=b&any=c&exclude=d, каждый параметр можно повторять.
+    tag_search оставлен для совместимости со старыми клиентами и работает как all.
+    """
+
+    def __init__(self,
+                 tags_all: list[str] = Query([], alias="all"),
+                 tags_any: list[str] = Query([], alias="any"),
+                 tags_exclude: list[str] = Query([], alias="exclude"),
+                 tag_search: Optional[str] = None,
+                 ):
+        self.all = tags_all + ([tag_search] if tag_search else [])
+        self.any = tags_any
+        self.exclude = tags_exclude
+        if not (self.all or self.any):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Provide at least one tag in 'all' or 'any'")
+        if len(self.all) + len(self.any) + len(self.exclude) > MAX_SEARCH_TAGS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Too many tags, maximum is {MAX_SEARCH_TAGS}")
+
+    def matched(self, tag_names: list[str]) -> list[str]:
+        wanted = set(self.all) | set(self.any)
+        return [name for name in tag_names if name in wanted]
+
+    def cache_key(self) -> tuple:
+        # порядок тегов в запросе не влияет на результат
+        return sorted(set(self.all)), sorted(set(self.any)), sorted(set(self.exclude))
+
+    def __str__(self):
+        return f"all={self.all} any={self.any} exclude={self.exclude}"
+
+
+"""
+Страницы списка и поиска собираются сразу в байты json: так их можно положить в кэш ответов
+и отдать из него без повторной сериализации. Одни и те же функции обслуживают хэндлеры с JWT и для бота.
+Аксессор отдает готовые строки (колонки и массив тегов), json из них собирает orjson без моделей pydantic.
+Поля и их порядок совпадают с NoteResponse/NoteSearchResult, схема ответа в OpenAPI не меняется.
+"""
+def note_item(row) -> dict:
+    return {
+        "id": row.id,
+        "title": row.title,
+        "content": row.content,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+        "tags": row.tags or [],
+    }
+
+
+def encode_page(items: list[dict], next_cursor: Optional[str]) -> bytes:
+    # OPT_UTC_Z: время в UTC пишется с суффиксом Z, как у pydantic
+    return orjson.dumps({"items": items, "next_cursor": next_cursor}, option=orjson.OPT_UTC_Z)
+
+
+async def notes_page(accessor: ContentManager, user_id: int, limit: int, cursor: Optional[str]) -> bytes:
+    rows, next_cursor = await accessor.get_notes_by_user_id(user_id, limit=limit, cursor=cursor)
+    return encode_page([note_item(row) for row in rows], next_cursor)
+
+
+async def tag_search_page(accessor: ContentManager, user_id: int, tag_search: TagFilter,
+                          limit: int, cursor: Optional[str]) -> bytes:
+    rows, next_cursor = await accessor.get_notes_by_tags(user_id,
+                                                         all_tags=tag_search.all,
+                                                         any_tags=tag_search.any,
+                                                         exclude_tags=tag_search.exclude,
+                                                         limit=limit, cursor=cursor)
+    items = []
+    for row in rows:
+        item = note_item(row)
+        item["matched_tags"] = tag_search.matched(item["tags"])
+        items.append(item)
+    return encode_page(items, next_cursor)
+
+
+async def text_search_page(accessor: ContentManager, user_id: int, q: str,
+                           limit: int, cursor: Optional[str]) -> bytes:
+    rows, next_cursor = await accessor.search_notes(q, user_id=user_id, limit=limit, cursor=cursor)
+    return encode_page([note_item(row) for row in rows], next_cursor)
+
+
+def note_response(note) -> NoteResponse:
+    return NoteResponse(
+        id=note.id,
+        title=note.title,
+        content=note.content,
+        created_at=note.created_at,
+        updated_at=note.updated_at,
+        tags=[tag.name for tag in note.tags]
+    )
+
+
+async def tags_page(accessor: ContentManager, user_id: int, limit: int, cursor: Optional[str]) -> TagPage:
+    rows, next_cursor = await accessor.get_tag_stats(user_id, limit=limit, cursor=cursor)
+    return TagPage(items=[TagSuggestion(name=row.name, count=row.note_count) for row in rows], next_cursor=next_cursor)
+
+
+async def apply_batch(accessor: ContentManager, user_id: int, batch: NoteBatch) -> NoteBatchResponse:
+    created, updated, deleted = await accessor.apply_batch(batch, user_id)
+    results = [NoteBatchResult(action="create", index=index, id=note.id, ok=True, note=note_response(note))
+               for index, note in enumerate(created)]
+    for index, (item, note) in enumerate(zip(batch.update, updated)):
+        if note is None:
+            results.append(NoteBatchResult(action="update", index=index, id=item.id, ok=False, error="Note not found"))
+        else:
+            results.append(NoteBatchResult(action="update", index=index, id=note.id, ok=True, note=note_response(note)))
+    for index, (note_id, ok) in enumerate(zip(batch.delete, deleted)):
+        results.append(NoteBatchResult(action="delete", index=index, id=note_id, ok=ok,
+                                       error=None if ok else "Note not found"))
+    return NoteBatchResponse(results=results)
+
+
+async def cached_page(request: Request, accessor: ContentManager, user_id: int, query: tuple,
+                      build: Callable[[], Awaitable[bytes]]) -> Response:
+    """
+    Страница списка или поиска с ETag. В кэше ответов тело лежит вместе со своим ETag,
+    поэтому при попадании в кэш обращения к БД нет. При промахе сначала одним дешевым запросом
+    считаем ETag и при совпадении с If-None-Match отвечаем 304, не читая и не сериализуя заметки.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    key = await response_cache.key(user_id, query)
+    cached = await response_cache.get(key)
+    if cached is not None:
+        etag, body = cached.split(b"\n", 1)
+        etag = etag.decode()
+    else:
+        etag = make_etag(user_id, await accessor.get_notes_revision(user_id), query)
+        body = None
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    if body is None:
+        body = await build()
+        await response_cache.set(key, etag.encode() + b"\n" + body)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+async def changes_page(accessor: ContentManager, user_id: int, since: int,
+                       limit: int, cursor: Optional[str]) -> NoteChanges:
+    notes, deleted, next_cursor, watermark = await accessor.get_changes(user_id, since, limit=limit, cursor=cursor)
+    return NoteChanges(items=[NoteResponse(
+        id=note.id,
+        title=note.title,
+        content=note.content,
+        created_at=note.created_at,
+        updated_at=note.updated_at,
+        tags=[tag.name for tag in note.tags]
+    ) for note in notes], deleted=deleted, next_cursor=next_cursor, since=watermark)
+
 
 @router.post("", status_code=status.HTTP_201_CREATED, response_model=NoteResponse)
 @limiter.limit("30/minute")
@@ -37,12 +196,30 @@ async def create_note(request: Request,
     try:
         new_note = await accessor.create_note(note_create, user.id)
         logger.info(f"Create note: User: {user.id}, Note: {new_note.id}")
-        return NoteResponse.from_orm(new_note)
+        return note_response(new_note)
     except Exception as e:
         logger.error(f"Error while creating note for {user.id}: {e}")
         return {"status": "error", "message": f"Error while creating note: {e}. Please try again."}
 
 
+# пачка созданий, изменений и удалений в одной транзакции
+@router.post("/batch", response_model=NoteBatchResponse)
+@limiter.limit("30/minute")
+async def batch_notes(request: Request,
+                      batch: NoteBatch,
+                      user: User = Depends(current_user),
+                      accessor: ContentManager = Depends(),
+                      ):
+    try:
+        response = await apply_batch(accessor, user.id, batch)
+        logger.info(f"Batch: User: {user.id}, create: {len(batch.create)}, update: {len(batch.update)}, "
+                    f"delete: {len(batch.delete)}")
+        return response
+    except Exception as e:
+        logger.error(f"Error while applying batch for {user.id}: {e}")
+        return {"status": "error", "message": f"Error while applying batch: {e}. Please try again."}
+
+
 @router.patch("/{note_id}", response_model=NoteResponse)
 @limiter.limit("30/minute")
 async def update_note(request: Request,
@@ -67,51 +244,152 @@ async def update_note(request: Request,
         return {"status": "error", "message": f"Error while updating note: {e}. Please try again."}
 
 
-@router.get("", response_model=List[NoteResponse])
+@router.get("", response_model=NotePage)
 @limiter.limit("5/minute")
 async def get_notes(request: Request,
+                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    cursor: Optional[str] = None,
                     user: User = Depends(current_user),
                     accessor: ContentManager = Depends()
                     ):
     try:
-        notes = await accessor.get_notes_by_user_id(user.id)
+        response = await cached_page(request, accessor, user.id, ("notes", limit, cursor),
+                                     lambda: notes_page(accessor, user.id, limit, cursor))
         logger.info(f"Get notes for User: {user.id}")
-        return [NoteResponse(
-            id=note.id,
-            title=note.title,
-            content=note.content,
-            created_at=note.created_at,
-            updated_at=note.updated_at,
-            tags=[tag.name for tag in note.tags]
-        ) for note in notes]
+        return response
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
     except Exception as e:
         logger.error(f"Error while getting notes for {user.id}: {e}")
         return {"status": "error", "message": f"Error while getting notes: {e}. Please try again."}
 
 
-@router.get("/search", response_model=List[NoteResponse])
+@router.get("/search", response_model=NoteSearchPage)
 @limiter.limit("30/minute")
 async def search_notes_by_tag(request: Request,
-                              tag_search: TagSearch,
+                              tag_search: TagFilter = Depends(),
+                              limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                              cursor: Optional[str] = None,
                               user: User = Depends(current_user),
                               accessor: ContentManager = Depends()
                               ):
     try:
-        notes = await accessor.get_notes_by_tag(tag_search, user_id=user.id)
+        response = await cached_page(request, accessor, user.id, ("tags", tag_search.cache_key(), limit, cursor),
+                                     lambda: tag_search_page(accessor, user.id, tag_search, limit, cursor))
         logger.info(f"Search notes by Tag: {tag_search} for User: {user.id}")
-        return [NoteResponse(
-            id=note.id,
-            title=note.title,
-            content=note.content,
-            created_at=note.created_at,
-            updated_at=note.updated_at,
-            tags=[tag.name for tag in note.tags]
-        ) for note in notes]
+        return response
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
     except Exception as e:
         logger.error(f"Error while Search notes by Tag: {tag_search} for {user.id}: {e}")
         return {"status": "error", "message": f"Error while search notes by tag {tag_search}: {e}. Please try again."}
 
 
+@router.get("/search/text", response_model=NotePage)
+@limiter.limit("30/minute")
+async def search_notes_by_text(request: Request,
+                               q: str = Query(..., min_length=1, max_length=256),
+                               limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                               cursor: Optional[str] = None,
+                               user: User = Depends(current_user),
+                               accessor: ContentManager = Depends()
+                               ):
+    try:
+        response = await cached_page(request, accessor, user.id, ("text", q, limit, cursor),
+                                     lambda: text_search_page(accessor, user.id, q, limit, cursor))
+        logger.info(f"Search notes by text: {q} for User: {user.id}")
+        return response
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"Error while Search notes by text: {q} for {user.id}: {e}")
+        return {"status": "error", "message": f"Error while search notes by text {q}: {e}. Please try again."}
+
+
+# изменения для синхронизации: новые и измененные после ревизии since заметки и ид удаленных,
+# первая синхронизация - since=0, дальше - since из предыдущего ответа
+@router.get("/changes", response_model=NoteChanges)
+@limiter.limit("30/minute")
+async def get_changes(request: Request,
+                      since: int = Query(0, ge=0),
+                      limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      cursor: Optional[str] = None,
+                      user: User = Depends(current_user),
+                      accessor: ContentManager = Depends()
+                      ):
+    try:
+        changes = await changes_page(accessor, user.id, since, limit, cursor)
+        logger.info(f"Get changes since {since} for User: {user.id}")
+        return changes
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"Error while getting changes for {user.id}: {e}")
+        return {"status": "error", "message": f"Error while getting changes: {e}. Please try again."}
+
+
+@router.get("/tags/autocomplete", response_model=list[TagSuggestion])
+@limiter.limit("120/minute")
+async def autocomplete_tags(request: Request,
+                            prefix: str = Query("", max_length=64),
+                            limit: int = Query(10, ge=1, le=50),
+                            user: User = Depends(current_user),
+                            accessor: ContentManager = Depends()
+                            ):
+    try:
+        tags = await accessor.autocomplete_tags(user.id, prefix, limit)
+        return [TagSuggestion(name=name, count=count) for name, count in tags]
+    except Exception as e:
+        logger.error(f"Error while autocomplete tags: {prefix} for {user.id}: {e}")
+        return {"status": "error", "message": f"Error while autocomplete tags {prefix}: {e}. Please try again."}
+
+
+# облако тегов: все теги пользователя с числом заметок, от частых к редким
+@router.get("/tags", response_model=TagPage)
+@limiter.limit("30/minute")
+async def get_tags(request: Request,
+                   limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                   cursor: Optional[str] = None,
+                   user: User = Depends(current_user),
+                   accessor: ContentManager = Depends()
+                   ):
+    try:
+        page = await tags_page(accessor, user.id, limit, cursor)
+        logger.info(f"Get tags for User: {user.id}")
+        return page
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"Error while getting tags for {user.id}: {e}")
+        return {"status": "error", "message": f"Error while getting tags: {e}. Please try again."}
+
+
+async def export_ndjson(user_id: int):
+    """
+    Генератор тела выгрузки: по одной строке JSON на заметку.
+    Сессия открывается здесь, а не через Depends - зависимости закрываются до того, как начнется отправка тела.
+    """
+    async with async_session_maker() as session:
+        async for batch in ContentManager(session).export_notes(user_id):
+            yield "".join(NoteResponse(
+                id=note.id,
+                title=note.title,
+                content=note.content,
+                created_at=note.created_at,
+                updated_at=note.updated_at,
+                tags=tags
+            ).model_dump_json() + "\n" for note, tags in batch)
+
+
+@router.get("/export")
+@limiter.limit("2/minute")
+async def export_notes(request: Request,
+                       user: User = Depends(current_user),
+                       ):
+    logger.info(f"Export notes for User: {user.id}")
+    return StreamingResponse(export_ndjson(user.id), media_type="application/x-ndjson")
+
+
 @router.delete("/{note_id}")
 @limiter.limit("30/minute")
 async def delete_note(request: Request,
@@ -139,7 +417,7 @@ async def create_note_tg(request: Request,
                          user_manager: UserManager = Depends(get_user_manager)
                          ):
     try:
-        user = await user_manager.user_db.get_by_telegram_id(telegram_id)
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
         new_note = await accessor.create_note(note_create, user.id)
         logger.info(f"Create note: User: {user.id}, Note: {new_note.id}")
         return NoteResponse(
@@ -155,6 +433,25 @@ async def create_note_tg(request: Request,
         return {"status": "error", "message": f"Error while creating note: {e}. Please try again."}
 
 
+@router.post("/tg/{telegram_id}/batch", response_model=NoteBatchResponse)
+@limiter.limit("30/minute")
+async def batch_notes_tg(request: Request,
+                         telegram_id: int,
+                         batch: NoteBatch,
+                         accessor: ContentManager = Depends(),
+                         user_manager: UserManager = Depends(get_user_manager)
+                         ):
+    try:
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
+        response = await apply_batch(accessor, user.id, batch)
+        logger.info(f"Batch: User: {user.id}, create: {len(batch.create)}, update: {len(batch.update)}, "
+                    f"delete: {len(batch.delete)}")
+        return response
+    except Exception as e:
+        logger.error(f"TG: Error while applying batch for User with telegram_id {telegram_id}: {e}")
+        return {"status": "error", "message": f"Error while applying batch: {e}. Please try again."}
+
+
 @router.patch("/tg/{telegram_id}/{note_id}", response_model=NoteResponse)
 @limiter.limit("30/minute")
 async def update_note_tg(request: Request,
@@ -165,7 +462,7 @@ async def update_note_tg(request: Request,
                          accessor: ContentManager = Depends(),
                          ):
     try:
-        user = await user_manager.user_db.get_by_telegram_id(telegram_id)
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
         new_note = await accessor.update_note(note_id, note_update, user.id)
         logger.info(f"Update note: User: {user.id}, Note: {new_note.id}")
         return NoteResponse(
@@ -181,55 +478,148 @@ async def update_note_tg(request: Request,
         return {"status": "error", "message": f"Error while updating note: {e}. Please try again."}
 
 
-@router.get("/tg/{telegram_id}", response_model=List[NoteResponse])
-@limiter.limit("5/minute")
+@router.get("/tg/{telegram_id}", response_model=NotePage)
+@limiter.limit("30/minute")
 async def get_notes_tg(request: Request,
                        telegram_id: int,
+                       limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       cursor: Optional[str] = None,
                        user_manager: UserManager = Depends(get_user_manager),
                        accessor: ContentManager = Depends()
                        ):
     try:
-        user = await user_manager.user_db.get_by_telegram_id(telegram_id)
-        notes = await accessor.get_notes_by_user_id(user.id)
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
+        response = await cached_page(request, accessor, user.id, ("notes", limit, cursor),
+                                     lambda: notes_page(accessor, user.id, limit, cursor))
         logger.info(f"Get notes for User: {user.id}")
-        return [NoteResponse(
-            id=note.id,
-            title=note.title,
-            content=note.content,
-            created_at=note.created_at,
-            updated_at=note.updated_at,
-            tags=[tag.name for tag in note.tags]
-        ) for note in notes]
+        return response
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
     except Exception as e:
         logger.error(f"TG: Error while getting notes for User with telegram_id {telegram_id}: {e}")
         return {"status": "error", "message": f"Error while getting notes: {e}. Please try again."}
 
 
-@router.get("/tg/{telegram_id}/search", response_model=List[NoteResponse])
+@router.get("/tg/{telegram_id}/search", response_model=NoteSearchPage)
 @limiter.limit("30/minute")
 async def search_notes_by_tag_tg(request: Request,
                                  telegram_id: int,
-                                 tag_search: str,
+                                 tag_search: TagFilter = Depends(),
+                                 limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                 cursor: Optional[str] = None,
                                  user_manager: UserManager = Depends(get_user_manager),
                                  accessor: ContentManager = Depends()
                                  ):
     try:
-        user = await user_manager.user_db.get_by_telegram_id(telegram_id)
-        notes = await accessor.get_notes_by_tag(tag_search, user_id=user.id)
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
+        response = await cached_page(request, accessor, user.id, ("tags", tag_search.cache_key(), limit, cursor),
+                                     lambda: tag_search_page(accessor, user.id, tag_search, limit, cursor))
         logger.info(f"Search notes by Tag: {tag_search} for User: {user.id}")
-        return [NoteResponse(
-            id=note.id,
-            title=note.title,
-            content=note.content,
-            created_at=note.created_at,
-            updated_at=note.updated_at,
-            tags=[tag.name for tag in note.tags]
-        ) for note in notes]
+        return response
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
     except Exception as e:
         logger.error(f"TG: Error while Search notes by Tag: {tag_search} for User with telegram_id {telegram_id}: {e}")
         return {"status": "error", "message": f"Error while search notes by tag {tag_search}: {e}. Please try again."}
 
 
+@router.get("/tg/{telegram_id}/search/text", response_model=NotePage)
+@limiter.limit("30/minute")
+async def search_notes_by_text_tg(request: Request,
+                                  telegram_id: int,
+                                  q: str = Query(..., min_length=1, max_length=256),
+                                  limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                  cursor: Optional[str] = None,
+                                  user_manager: UserManager = Depends(get_user_manager),
+                                  accessor: ContentManager = Depends()
+                                  ):
+    try:
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
+        response = await cached_page(request, accessor, user.id, ("text", q, limit, cursor),
+                                     lambda: text_search_page(accessor, user.id, q, limit, cursor))
+        logger.info(f"Search notes by text: {q} for User: {user.id}")
+        return response
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"TG: Error while Search notes by text: {q} for User with telegram_id {telegram_id}: {e}")
+        return {"status": "error", "message": f"Error while search notes by text {q}: {e}. Please try again."}
+
+
+@router.get("/tg/{telegram_id}/changes", response_model=NoteChanges)
+@limiter.limit("30/minute")
+async def get_changes_tg(request: Request,
+                         telegram_id: int,
+                         since: int = Query(0, ge=0),
+                         limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                         cursor: Optional[str] = None,
+                         user_manager: UserManager = Depends(get_user_manager),
+                         accessor: ContentManager = Depends()
+                         ):
+    try:
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
+        changes = await changes_page(accessor, user.id, since, limit, cursor)
+        logger.info(f"Get changes since {since} for User: {user.id}")
+        return changes
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"TG: Error while getting changes for User with telegram_id {telegram_id}: {e}")
+        return {"status": "error", "message": f"Error while getting changes: {e}. Please try again."}
+
+
+@router.get("/tg/{telegram_id}/tags/autocomplete", response_model=list[TagSuggestion])
+@limiter.limit("120/minute")
+async def autocomplete_tags_tg(request: Request,
+                               telegram_id: int,
+                               prefix: str = Query("", max_length=64),
+                               limit: int = Query(10, ge=1, le=50),
+                               user_manager: UserManager = Depends(get_user_manager),
+                               accessor: ContentManager = Depends()
+                               ):
+    try:
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
+        tags = await accessor.autocomplete_tags(user.id, prefix, limit)
+        return [TagSuggestion(name=name, count=count) for name, count in tags]
+    except Exception as e:
+        logger.error(f"TG: Error while autocomplete tags: {prefix} for User with telegram_id {telegram_id}: {e}")
+        return {"status": "error", "message": f"Error while autocomplete tags {prefix}: {e}. Please try again."}
+
+
+@router.get("/tg/{telegram_id}/tags", response_model=TagPage)
+@limiter.limit("30/minute")
+async def get_tags_tg(request: Request,
+                      telegram_id: int,
+                      limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      cursor: Optional[str] = None,
+                      user_manager: UserManager = Depends(get_user_manager),
+                      accessor: ContentManager = Depends()
+                      ):
+    try:
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
+        page = await tags_page(accessor, user.id, limit, cursor)
+        logger.info(f"Get tags for User: {user.id}")
+        return page
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"TG: Error while getting tags for User with telegram_id {telegram_id}: {e}")
+        return {"status": "error", "message": f"Error while getting tags: {e}. Please try again."}
+
+
+@router.get("/tg/{telegram_id}/export")
+@limiter.limit("2/minute")
+async def export_notes_tg(request: Request,
+                          telegram_id: int,
+                          user_manager: UserManager = Depends(get_user_manager),
+                          ):
+    user = await user_manager.get_principal_by_telegram_id(telegram_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    logger.info(f"Export notes for User: {user.id}")
+    return StreamingResponse(export_ndjson(user.id), media_type="application/x-ndjson")
+
+
 @router.delete("/tg/{telegram_id}/{note_id}")
 @limiter.limit("30/minute")
 async def delete_note_tg(request: Request,
@@ -239,7 +629,7 @@ async def delete_note_tg(request: Request,
                          accessor: ContentManager = Depends(),
                          ):
     try:
-        user = await user_manager.user_db.get_by_telegram_id(telegram_id)
+        user = await user_manager.get_principal_by_telegram_id(telegram_id)
         await accessor.delete_note(note_id, user.id)
         logger.info(f"Delete Note: {note_id} for User: {user.id}")
         return
@@ -1,6 +1,10 @@
 from datetime import datetime
+from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
+
+# сколько операций можно прислать в одной пачке
+MAX_BATCH_SIZE = 500
 
 
 class TagCreate(BaseModel):
@@ -34,3 +38,64 @@ class NoteResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class NoteBatch(BaseModel):
+    create: list[NoteCreate] = []
+    update: list[NoteUpdate] = []
+    delete: list[int] = []
+
+    @model_validator(mode="after")
+    def check_size(self):
+        size = len(self.create) + len(self.update) + len(self.delete)
+        if not size:
+            raise ValueError("Batch is empty")
+        if size > MAX_BATCH_SIZE:
+            raise ValueError(f"Too many operations in batch, maximum is {MAX_BATCH_SIZE}")
+        return self
+
+
+class NoteBatchResult(BaseModel):
+    # create, update или delete и номер элемента в соответствующем списке запроса
+    action: str
+    index: int
+    id: Optional[int] = None
+    ok: bool
+    error: Optional[str] = None
+    note: Optional[NoteResponse] = None
+
+
+class NoteBatchResponse(BaseModel):
+    results: list[NoteBatchResult]
+
+
+class NotePage(BaseModel):
+    items: list[NoteResponse]
+    next_cursor: Optional[str] = None
+
+
+class NoteChanges(BaseModel):
+    items: list[NoteResponse]
+    deleted: list[int]
+    next_cursor: Optional[str] = None
+    # ревизия, до которой клиент синхронизирован, передается как since при следующей синхронизации
+    since: int
+
+
+class TagSuggestion(BaseModel):
+    name: str
+    count: int
+
+
+class TagPage(BaseModel):
+    items: list[TagSuggestion]
+    next_cursor: Optional[str] = None
+
+
+class NoteSearchResult(NoteResponse):
+    matched_tags: list[str]
+
+
+class NoteSearchPage(BaseModel):
+    items: list[NoteSearchResult]
+    next_cursor: Optional[str] = None
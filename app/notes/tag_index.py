@@ -0,0 +1,120 @@
+import bisect
+import heapq
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+
+
+class UserTags:
+    """
+    Теги одного пользователя: отсортированный список имен для поиска по префиксу
+    и число заметок с каждым тегом для сортировки подсказок
+    """
+
+    def __init__(self, counts: Dict[str, int]):
+        self.counts = dict(counts)
+        self.names = sorted(self.counts)
+        self.loaded_at = time.monotonic()
+
+    def add(self, name: str):
+        if name in self.counts:
+            self.counts[name] += 1
+        else:
+            self.counts[name] = 1
+            bisect.insort(self.names, name)
+
+    def remove(self, name: str):
+        count = self.counts.get(name)
+        if count is None:
+            return
+        if count > 1:
+            self.counts[name] = count - 1
+            return
+        del self.counts[name]
+        self.names.pop(bisect.bisect_left(self.names, name))
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + "\U0010ffff", lo=start)
+        return heapq.nsmallest(limit,
+                               ((name, self.counts[name]) for name in self.names[start:end]),
+                               key=lambda item: (-item[1], item[0]))
+
+
+class TagIndex:
+    """
+    Индекс тегов в памяти процесса для автодополнения. Теги пользователя загружаются из БД
+    при первом обращении и дальше обновляются ContentManager после каждого изменения заметок.
+    Количество пользователей в индексе ограничено LRU, запись живет не дольше ttl секунд,
+    чтобы изменения, сделанные другими воркерами, рано или поздно подтягивались.
+    """
+
+    def __init__(self, max_users: int, ttl: float):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._users: OrderedDict[int, UserTags] = OrderedDict()
+        # пользователи, чьи теги сейчас читаются из БД: [поколение, число чтений в процессе].
+        # apply и invalidate увеличивают поколение, чтение кэшируется, только если поколение не изменилось
+        self._loading: Dict[int, List[int]] = {}
+
+    def get(self, user_id: int) -> Optional[UserTags]:
+        tags = self._users.get(user_id)
+        if tags is None:
+            return None
+        if time.monotonic() - tags.loaded_at > self.ttl:
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return tags
+
+    def begin_load(self, user_id: int) -> int:
+        """
+        Отмечает начало чтения тегов из БД, возвращает поколение, которое нужно передать в finish_load
+        """
+        state = self._loading.setdefault(user_id, [0, 0])
+        state[1] += 1
+        return state[0]
+
+    def finish_load(self, user_id: int, generation: int, counts: Optional[Dict[str, int]]) -> Optional[UserTags]:
+        """
+        Завершает чтение, начатое begin_load; counts=None - чтение не удалось, кэшировать нечего
+        """
+        state = self._loading[user_id]
+        current = state[0]
+        state[1] -= 1
+        if not state[1]:
+            del self._loading[user_id]
+        if counts is None:
+            return None
+        tags = UserTags(counts)
+        # если пока шло чтение теги изменились, прочитанные данные могли устареть - не кэшируем их
+        if current == generation:
+            self._users[user_id] = tags
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return tags
+
+    def _bump(self, user_id: int):
+        state = self._loading.get(user_id)
+        if state is not None:
+            state[0] += 1
+
+    def apply(self, user_id: int, added: Iterable[str] = (), removed: Iterable[str] = ()):
+        self._bump(user_id)
+        tags = self._users.get(user_id)
+        if tags is None:
+            return
+        for name in added:
+            tags.add(name)
+        for name in removed:
+            tags.remove(name)
+
+    def invalidate(self, user_id: int):
+        self._bump(user_id)
+        self._users.pop(user_id, None)
+
+
+tag_index = TagIndex(max_users=settings.TAG_INDEX_MAX_USERS, ttl=settings.TAG_INDEX_TTL)
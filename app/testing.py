@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from typing import List
+
+from metrics import QueryStats, instrument_engine, track_queries
+
+"""
+Помощники для тестов: проверка числа SQL-выражений, чтобы N+1 в хэндлерах ломал CI.
+
+    async def test_notes_list(client):
+        with assert_max_queries(2):
+            response = await client.get("/notes")
+
+Запросы к приложению нужно делать через httpx.AsyncClient(transport=httpx.ASGITransport(app=app)):
+приложение выполняется в той же задаче, что и тест, и видит тот же счетчик. TestClient запускает приложение
+в другом потоке, там счетчик не виден. Если тесты подменяют движок БД, его нужно подключить через instrument_engine.
+"""
+
+__all__ = ["QueryCounter", "assert_max_queries", "count_queries", "instrument_engine"]
+
+
+class QueryCounter:
+    """
+    SQL-выражения, выполненные с начала блока count_queries
+    """
+
+    def __init__(self, stats: QueryStats):
+        self._stats = stats
+        self._start = stats.statements
+        self._log_start = len(stats.log)
+
+    @property
+    def count(self) -> int:
+        return self._stats.statements - self._start
+
+    @property
+    def statements(self) -> List[str]:
+        return self._stats.log[self._log_start:]
+
+
+@contextmanager
+def count_queries():
+    with track_queries(record=True) as stats:
+        yield QueryCounter(stats)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Падает с AssertionError, если внутри блока выполнено больше limit SQL-выражений.
+    В сообщение попадают тексты всех выражений блока.
+    """
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(f"{number}. {statement}" for number, statement in enumerate(counter.statements, 1))
+        raise AssertionError(f"Expected at most {limit} SQL statements, got {counter.count}:\n{statements}")
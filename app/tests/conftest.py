@@ -0,0 +1,75 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# тесты запускаются из app/ или из корня репозитория, модули приложения импортируются так же, как в app/
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database import create_engine
+from notes.models import DeletedNote, Note, NoteRevision, NoteTag, Tag, UserTagStat
+from testing import instrument_engine
+from users.models import User
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session_maker():
+    """
+    Сессии к Postgres из .env. Движок без пула: соединения не переживают event loop теста
+    """
+    engine = create_engine(nullpool=True)
+    instrument_engine(engine.sync_engine)
+    yield async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+    await engine.dispose()
+
+
+async def create_user(session_maker) -> int:
+    async with session_maker() as session:
+        user = User(email=f"test-{uuid.uuid4().hex[:8]}@example.com", hashed_password="-")
+        session.add(user)
+        await session.commit()
+    return user.id
+
+
+async def delete_user(session_maker, user_id: int):
+    async with session_maker() as session:
+        note_ids = select(Note.id).where(Note.user_id == user_id)
+        await session.execute(delete(NoteTag).where(NoteTag.note_id.in_(note_ids)))
+        await session.execute(delete(Note).where(Note.user_id == user_id))
+        await session.execute(delete(DeletedNote).where(DeletedNote.user_id == user_id))
+        await session.execute(delete(UserTagStat).where(UserTagStat.user_id == user_id))
+        await session.execute(delete(NoteRevision).where(NoteRevision.user_id == user_id))
+        await session.execute(delete(Tag).where(Tag.name.startswith(f"test-{user_id}-")))
+        await session.execute(delete(User).where(User.id == user_id))
+        await session.commit()
+
+
+@pytest.fixture
+async def user_id(session_maker):
+    """
+    Отдельный пользователь на тест. После теста удаляются его заметки и теги с префиксом f"test-{user_id}-"
+    """
+    user_id = await create_user(session_maker)
+    yield user_id
+    await delete_user(session_maker, user_id)
+
+
+@pytest.fixture
+async def other_user_id(session_maker, user_id):
+    """
+    Второй пользователь теста. Удаляется раньше первого, поэтому может ссылаться на его теги
+    """
+    other_user_id = await create_user(session_maker)
+    yield other_user_id
+    await delete_user(session_maker, other_user_id)
@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import insert
+
+from notes.accessor import ContentManager
+from notes.models import Note, NoteTag, Tag
+from notes.schemas import NoteCreate
+from testing import assert_max_queries, count_queries
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_create_note_query_budget(session_maker, user_id):
+    """
+    Создание заметки с тегами укладывается в 5 выражений, в том числе когда часть тегов уже существует
+    """
+    tags = [f"test-{user_id}-work", f"test-{user_id}-todo"]
+    async with session_maker() as session:
+        await ContentManager(session).create_note(NoteCreate(title="first", content="text", tags=tags[:1]), user_id)
+
+    async with session_maker() as session:
+        with assert_max_queries(5):
+            note = await ContentManager(session).create_note(
+                NoteCreate(title="second", content="text", tags=tags), user_id
+            )
+
+    assert note.title == "second"
+    assert sorted(tag.name for tag in note.tags) == sorted(tags)
+
+
+async def test_create_note_cost_does_not_depend_on_other_users(session_maker, user_id, other_user_id):
+    """
+    Заметки другого пользователя с тем же тегом не добавляют ни выражений, ни загруженных в сессию объектов
+    """
+    tag = f"test-{user_id}-popular"
+    # тег создаем заранее: новый тег обходится на одно выражение дешевле существующего
+    async with session_maker() as session:
+        popular = Tag(name=tag)
+        session.add(popular)
+        await session.commit()
+
+    async def create_note() -> tuple:
+        async with session_maker() as session:
+            with count_queries() as counter:
+                note = await ContentManager(session).create_note(
+                    NoteCreate(title="note", content="text", tags=[tag]), user_id
+                )
+            # identity map хранит слабые ссылки, note держит заметку и ее теги до подсчета
+            return counter.count, len(session.identity_map), [note_tag.name for note_tag in note.tags]
+
+    before = await create_note()
+
+    async with session_maker() as session:
+        note_ids = (await session.scalars(
+            insert(Note).returning(Note.id),
+            [{"title": "other", "content": "other note", "user_id": other_user_id, "revision": 0}
+             for _ in range(1000)],
+        )).all()
+        await session.execute(insert(NoteTag), [{"note_id": note_id, "tag_id": popular.id} for note_id in note_ids])
+        await session.commit()
+
+    after = await create_note()
+
+    assert after == before
+    assert before[2] == [tag]
@@ -0,0 +1,58 @@
+import anyio
+import pytest
+
+from notes.accessor import ContentManager
+from testing import assert_max_queries, count_queries
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_count_queries_sees_accessor_statements(session_maker, user_id):
+    async with session_maker() as session:
+        with count_queries() as counter:
+            await ContentManager(session).get_notes_by_user_id(user_id)
+
+    assert counter.count == 1
+    assert "FROM notes" in counter.statements[0]
+
+
+async def test_assert_max_queries_lists_statements(session_maker, user_id):
+    async with session_maker() as session:
+        with pytest.raises(AssertionError, match="Expected at most 0 SQL statements, got 1") as error:
+            with assert_max_queries(0):
+                await ContentManager(session).get_notes_by_user_id(user_id)
+
+    assert "FROM notes" in str(error.value)
+
+
+async def test_nested_blocks(session_maker, user_id):
+    async with session_maker() as session:
+        accessor = ContentManager(session)
+        with count_queries() as outer:
+            await accessor.get_notes_revision(user_id)
+            with count_queries() as inner:
+                await accessor.get_notes_by_user_id(user_id)
+
+    assert inner.count == 1
+    assert outer.count == 2
+
+
+async def test_concurrent_tasks_count_separately(session_maker, user_id):
+    """
+    Счетчик живет в ContextVar задачи: выражения соседней задачи в него не попадают
+    """
+    counts = {}
+
+    async def run(name: str, calls: int):
+        async with session_maker() as session:
+            with count_queries() as counter:
+                for _ in range(calls):
+                    await ContentManager(session).get_notes_revision(user_id)
+                    await anyio.sleep(0)
+        counts[name] = counter.count
+
+    async with anyio.create_task_group() as tasks:
+        tasks.start_soon(run, "one", 1)
+        tasks.start_soon(run, "three", 3)
+
+    assert counts == {"one": 1, "three": 3}
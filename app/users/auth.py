@@ -1,11 +1,17 @@
+from typing import Optional
 
+import jwt
+from fastapi import Depends, Request
+from fastapi_users import exceptions
 from fastapi_users.authentication import AuthenticationBackend, BearerTransport
 from fastapi_users.authentication.strategy import JWTStrategy
 from fastapi_users import FastAPIUsers
+from fastapi_users.jwt import decode_jwt
 
-from users.manager import get_user_manager
+from users.manager import UserManager, get_user_manager
 from config import settings
 from users.models import User
+from users.principals import Principal, principal_cache
 
 SECRET = settings.JWT_SECRET
 
@@ -13,9 +19,33 @@ SECRET = settings.JWT_SECRET
 bearer_transport = BearerTransport(tokenUrl="users/auth/jwt/login")
 
 
+class CachedJWTStrategy(JWTStrategy):
+    """
+    JWT с кэшем пользователей: для уже проверенного токена не проверяется подпись и не читается строка User,
+    вместо нее возвращается Principal из кэша. Запись живет не дольше самого токена.
+    """
+
+    async def read_token(self, token: Optional[str], user_manager: UserManager) -> Optional[Principal]:
+        if token is None:
+            return None
+        principal = principal_cache.get_by_token(token)
+        if principal is not None:
+            return principal
+
+        version = principal_cache.version
+        try:
+            data = decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+            user = await user_manager.get(user_manager.parse_id(data["sub"]))
+        except (jwt.PyJWTError, KeyError, exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+        principal = Principal.from_user(user)
+        principal_cache.set_by_token(token, principal, version, expires_at=data.get("exp"))
+        return principal
+
+
 # в качестве механизма аутентификации - JWT
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600)
 
 
 auth_backend = AuthenticationBackend(
@@ -30,5 +60,11 @@ fastapi_users = FastAPIUsers[User, int](
     [auth_backend]
 )
 
-current_user = fastapi_users.current_user()
+_current_user = fastapi_users.current_user()
+
+
+async def current_user(request: Request, user: Principal = Depends(_current_user)) -> Principal:
+    # запоминаем пользователя для лога запросов
+    request.state.user_id = user.id
+    return user
 
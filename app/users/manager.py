@@ -1,7 +1,8 @@
-from typing import Optional
+from typing import Any, Dict, Optional
 
-from fastapi import Depends
-from fastapi_users import BaseUserManager, IntegerIDMixin
+from fastapi import Depends, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi_users import BaseUserManager, IntegerIDMixin, exceptions
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -9,7 +10,9 @@ from fastapi_users.db import SQLAlchemyUserDatabase
 from config import settings
 from database import get_async_session
 from users.models import User
-from users.schemas import UserUpdate
+from users.passwords import password_helper, password_pool
+from users.principals import Principal, principal_cache
+from users.schemas import UserCreate, UserUpdate
 
 
 # расширяем базовый функционал методов для работы с юзерами, добавляем получение по телеграм_ид
@@ -33,6 +36,40 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     async def on_after_register(self, user: User, request=None):
         print(f"User {user.id} has registered.")
 
+    # authenticate и create повторяют версии из BaseUserManager, но считают хэши в password_pool,
+    # а не в event loop
+    async def authenticate(self, credentials: OAuth2PasswordRequestForm) -> Optional[User]:
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # хэш считаем и для несуществующего пользователя, чтобы по времени ответа нельзя было это понять
+            await password_pool.hash(credentials.password)
+            return None
+
+        verified, updated_password_hash = await password_pool.verify_and_update(credentials.password,
+                                                                                user.hashed_password)
+        if not verified:
+            return None
+        # хэш с устаревшими параметрами пересчитан при проверке, сохраняем новый
+        if updated_password_hash is not None:
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+        return user
+
+    async def create(self, user_create: UserCreate, safe: bool = False, request: Optional[Request] = None) -> User:
+        await self.validate_password(user_create.password, user_create)
+
+        existing_user = await self.user_db.get_by_email(user_create.email)
+        if existing_user is not None:
+            raise exceptions.UserAlreadyExists()
+
+        user_dict = user_create.create_update_dict() if safe else user_create.create_update_dict_superuser()
+        password = user_dict.pop("password")
+        user_dict["hashed_password"] = await password_pool.hash(password)
+
+        created_user = await self.user_db.create(user_dict)
+        await self.on_after_register(created_user, request)
+        return created_user
+
     async def link_accounts_telegram(self, user_update: UserUpdate):
         _user = await self.is_user_exist_by_telegram_id(user_update.telegram_id)
         if _user:
@@ -44,13 +81,35 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
             raise ValueError("User with this email does not exist.")
 
         await self.user_db.update(user, {"telegram_id": user_update.telegram_id})
+        principal_cache.invalidate(user.id)
         return user
 
     async def is_user_exist_by_telegram_id(self, telegram_id: int) -> Optional[User]:
         return await self.user_db.get_by_telegram_id(telegram_id)
 
+    async def get_principal_by_telegram_id(self, telegram_id: int) -> Optional[Principal]:
+        """
+        Пользователь для хэндлеров бота: из кэша, при промахе - из БД
+        """
+        principal = principal_cache.get_by_telegram_id(telegram_id)
+        if principal is not None:
+            return principal
+        version = principal_cache.version
+        user = await self.user_db.get_by_telegram_id(telegram_id)
+        if user is None:
+            return None
+        principal = Principal.from_user(user)
+        principal_cache.set_by_telegram_id(telegram_id, principal, version)
+        return principal
+
+    async def on_after_update(self, user: User, update_dict: Dict[str, Any], request=None):
+        principal_cache.invalidate(user.id)
+
+    async def on_after_delete(self, user: User, request=None):
+        principal_cache.invalidate(user.id)
+
 
 # используется для инъекции зависимости
 async def get_user_manager(user_db=Depends(get_user_db)):
-    yield UserManager(user_db)
+    yield UserManager(user_db, password_helper)
 
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+from fastapi_users.password import PasswordHelper
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+from pwdlib.hashers.bcrypt import BcryptHasher
+from starlette import status
+
+from config import settings
+from metrics import metrics
+
+T = TypeVar("T")
+
+
+def build_password_helper() -> PasswordHelper:
+    """
+    Хэшер паролей с параметрами argon2 из настроек. Старые хэши bcrypt и хэши с другими параметрами
+    по-прежнему проверяются, а при входе verify_and_update пересчитывает их с текущими параметрами.
+    """
+    return PasswordHelper(PasswordHash((
+        Argon2Hasher(time_cost=settings.PASSWORD_ARGON2_TIME_COST,
+                     memory_cost=settings.PASSWORD_ARGON2_MEMORY_COST,
+                     parallelism=settings.PASSWORD_ARGON2_PARALLELISM),
+        BcryptHasher(),
+    )))
+
+
+class PasswordHashPool:
+    """
+    Хэширование и проверка паролей в отдельном пуле потоков: argon2 и bcrypt отпускают GIL на время расчета,
+    поэтому event loop продолжает обслуживать другие запросы, пока идет вход или регистрация.
+    Одновременно считается не больше max_workers хэшей, еще max_pending ждут в очереди,
+    остальные запросы сразу получают 503 - очередь не растет без ограничений во время всплеска входов.
+    """
+
+    def __init__(self, helper: PasswordHelper, max_workers: int, max_pending: int):
+        self.helper = helper
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid = None
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.helper.hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run("verify", self.helper.verify_and_update, plain_password, hashed_password)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending - self.max_workers)
+
+    async def _run(self, operation: str, func: Callable[..., T], *args) -> T:
+        if self.pending >= self.max_workers + self.max_pending:
+            metrics.observe_password_rejected(operation)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many login attempts in progress. Please try again later.",
+                                headers={"Retry-After": "1"})
+
+        def job():
+            started = time.perf_counter()
+            return started, func(*args), time.perf_counter()
+
+        self.pending += 1
+        metrics.set_password_pool(in_flight=self.pending - self.queued, queued=self.queued)
+        submitted = time.perf_counter()
+        try:
+            started, result, finished = await asyncio.get_running_loop().run_in_executor(self._get_executor(), job)
+        finally:
+            self.pending -= 1
+            metrics.set_password_pool(in_flight=self.pending - self.queued, queued=self.queued)
+        metrics.observe_password(operation, wait=started - submitted, duration=finished - started)
+        return result
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # потоки не переживают fork, каждый воркер создает свой пул
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hash")
+            self._pid = os.getpid()
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_helper = build_password_helper()
+password_pool = PasswordHashPool(password_helper,
+                                 max_workers=settings.PASSWORD_HASH_WORKERS,
+                                 max_pending=settings.PASSWORD_HASH_MAX_PENDING)
@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+from config import settings
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Легкая замена строки User для проверки доступа: хэндлерам заметок нужен только id,
+    fastapi-users проверяет is_active/is_verified/is_superuser
+    """
+    id: int
+    email: str
+    telegram_id: Optional[int]
+    is_active: bool
+    is_verified: bool
+    is_superuser: bool
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(id=user.id, email=user.email, telegram_id=user.telegram_id, is_active=user.is_active,
+                   is_verified=user.is_verified, is_superuser=user.is_superuser)
+
+
+class PrincipalCache:
+    """
+    Кэш пользователей по JWT и по telegram_id, чтобы авторизованные запросы не читали пользователя из БД.
+    Размер ограничен LRU, запись живет не дольше ttl секунд и не дольше самого токена.
+    После изменения пользователя его записи удаляются. Кэш в памяти процесса: другие воркеры uvicorn
+    увидят изменение не позже чем через ttl, поэтому ttl стоит держать коротким.
+    Отсутствующие пользователи не кэшируются: только что привязанный telegram_id должен работать сразу.
+    """
+
+    def __init__(self, max_size: int, ttl: float, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        # увеличивается при каждой инвалидации: данные, прочитанные из БД до нее, в кэш не попадут
+        self.version = 0
+        self._entries: OrderedDict[Hashable, Tuple[Principal, float]] = OrderedDict()
+        self._keys_by_user: Dict[int, Set[Hashable]] = {}
+
+    def get_by_token(self, token: str) -> Optional[Principal]:
+        return self._get(("jwt", token))
+
+    def set_by_token(self, token: str, principal: Principal, version: int, expires_at: Optional[float] = None):
+        self._set(("jwt", token), principal, version, expires_at)
+
+    def get_by_telegram_id(self, telegram_id: int) -> Optional[Principal]:
+        return self._get(("tg", telegram_id))
+
+    def set_by_telegram_id(self, telegram_id: int, principal: Principal, version: int):
+        self._set(("tg", telegram_id), principal, version)
+
+    def invalidate(self, user_id: int):
+        self.version += 1
+        for key in self._keys_by_user.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self.version += 1
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _get(self, key: Hashable) -> Optional[Principal]:
+        if not self.enabled:
+            return None
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        if item[1] <= time.time():
+            self._pop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def _set(self, key: Hashable, principal: Principal, version: int, expires_at: Optional[float] = None):
+        if not self.enabled or version != self.version:
+            return
+        expires = time.time() + self.ttl
+        if expires_at is not None:
+            expires = min(expires, expires_at)
+        self._pop(key)
+        self._entries[key] = (principal, expires)
+        self._keys_by_user.setdefault(principal.id, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: Hashable):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        keys = self._keys_by_user.get(item[0].id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[item[0].id]
+
+
+principal_cache = PrincipalCache(max_size=settings.AUTH_CACHE_MAX_SIZE,
+                                 ttl=settings.AUTH_CACHE_TTL,
+                                 enabled=settings.AUTH_CACHE_ENABLED)
@@ -0,0 +1,116 @@
+"""
+Создание заметок по одной через POST /notes против пачек через POST /notes/batch.
+Заметки создаются у отдельного пользователя и удаляются после замера.
+Запуск из корня репозитория (нужны .env и Postgres с примененными миграциями):
+
+    python -m benchmarks.batch --notes 1000 --batch-size 100 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from types import SimpleNamespace
+
+import httpx
+from sqlalchemy import delete, select
+
+from benchmarks.common import run_concurrently, summarize
+from database import async_session_maker
+from limiter import limiter
+from main import app
+from notes.models import DeletedNote, Note, NoteRevision, NoteTag, UserTagStat
+from users.auth import current_user
+from users.models import User
+
+TAGS = [f"benchtag{i}" for i in range(50)]
+
+
+def random_note(rnd: random.Random, number: int) -> dict:
+    return {
+        "title": f"note {number}",
+        "content": " ".join(rnd.choice(TAGS) for _ in range(30)),
+        "tags": rnd.sample(TAGS, 3),
+    }
+
+
+async def bench_single(client, notes: list[dict], concurrency: int) -> dict:
+    queue = iter(notes)
+
+    async def call():
+        response = await client.post("/notes", json=next(queue))
+        response.raise_for_status()
+
+    latencies, elapsed = await run_concurrently(call, len(notes), concurrency)
+    return {**summarize(latencies, elapsed), "notes_per_second": round(len(notes) / elapsed, 2)}
+
+
+async def bench_batch(client, notes: list[dict], batch_size: int, concurrency: int) -> dict:
+    queue = iter([notes[start:start + batch_size] for start in range(0, len(notes), batch_size)])
+
+    async def call():
+        response = await client.post("/notes/batch", json={"create": next(queue)})
+        response.raise_for_status()
+
+    batches = -(-len(notes) // batch_size)
+    latencies, elapsed = await run_concurrently(call, batches, concurrency)
+    return {**summarize(latencies, elapsed), "notes_per_second": round(len(notes) / elapsed, 2)}
+
+
+async def bench_batch_delete(client, user_id: int, batch_size: int) -> dict:
+    async with async_session_maker() as session:
+        note_ids = list(await session.scalars(select(Note.id).where(Note.user_id == user_id)))
+    start = time.perf_counter()
+    for offset in range(0, len(note_ids), batch_size):
+        response = await client.post("/notes/batch", json={"delete": note_ids[offset:offset + batch_size]})
+        response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return {"notes": len(note_ids), "seconds": round(elapsed, 3), "notes_per_second": round(len(note_ids) / elapsed, 2)}
+
+
+async def cleanup(user_id: int):
+    async with async_session_maker() as session:
+        note_ids = select(Note.id).where(Note.user_id == user_id)
+        await session.execute(delete(NoteTag).where(NoteTag.note_id.in_(note_ids)))
+        await session.execute(delete(Note).where(Note.user_id == user_id))
+        await session.execute(delete(DeletedNote).where(DeletedNote.user_id == user_id))
+        await session.execute(delete(UserTagStat).where(UserTagStat.user_id == user_id))
+        await session.execute(delete(NoteRevision).where(NoteRevision.user_id == user_id))
+        await session.commit()
+
+
+async def main(args):
+    limiter.enabled = False
+    rnd = random.Random(args.seed)
+    notes = [random_note(rnd, number) for number in range(args.notes)]
+
+    async with async_session_maker() as session:
+        user = User(email=f"bench-{uuid.uuid4().hex}@example.com", hashed_password="-")
+        session.add(user)
+        await session.commit()
+    app.dependency_overrides[current_user] = lambda: SimpleNamespace(id=user.id)
+
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            results = {"single": await bench_single(client, notes, args.concurrency)}
+            await cleanup(user.id)
+            results["batch"] = await bench_batch(client, notes, args.batch_size, args.concurrency)
+            results["batch_delete"] = await bench_batch_delete(client, user.id, args.batch_size)
+        results["speedup"] = round(results["batch"]["notes_per_second"] / results["single"]["notes_per_second"], 2)
+        print(json.dumps({"notes": args.notes, "batch_size": args.batch_size, "results": results}, indent=2))
+    finally:
+        app.dependency_overrides.clear()
+        await cleanup(user.id)
+        async with async_session_maker() as session:
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable
+
+# бенчмарки запускаются из корня репозитория, модули приложения импортируются так же, как в app/
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    """
+    Сводка по замерам: задержки в миллисекундах и пропускная способность
+    """
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def run_concurrently(call: Callable[[], Awaitable], total: int, concurrency: int) -> tuple[list[float], float]:
+    """
+    Выполняем call total раз, не более concurrency одновременно.
+    Возвращаем задержки каждого вызова и общее время.
+    """
+    latencies = []
+    queue = iter(range(total))
+
+    async def worker():
+        for _ in queue:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
@@ -0,0 +1,95 @@
+"""
+Сравнение двух отчетов benchmarks.load: изменение p50/p95/p99 и пропускной способности по каждому эндпоинту.
+Регрессия - рост p95 или p99 больше чем на --threshold процентов (и больше чем на --min-delta-ms)
+или рост доли ошибок больше чем на 1%. Пропускная способность проверяется только для прогона целиком:
+у отдельного эндпоинта она зависит от того, сколько раз он выпал в случайной смеси операций.
+При регрессиях скрипт завершается с кодом 1, поэтому его можно запускать в CI. Запуск из корня репозитория:
+
+    python -m benchmarks.compare base.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+CHECKED_KEYS = ("p95_ms", "p99_ms")
+
+
+def change(old: float, new: float) -> float:
+    if not old:
+        return 0.0
+    return (new - old) / old * 100
+
+
+def error_rate(result: dict) -> float:
+    return result.get("errors", 0) / result["requests"] if result["requests"] else 0.0
+
+
+def compare_endpoint(old: dict, new: dict, threshold: float, min_delta_ms: float,
+                     check_throughput: bool = False) -> list[str]:
+    problems = []
+    for key in CHECKED_KEYS:
+        delta = new[key] - old[key]
+        if change(old[key], new[key]) > threshold and delta > min_delta_ms:
+            problems.append(f"{key} {old[key]:.2f} -> {new[key]:.2f} (+{change(old[key], new[key]):.1f}%)")
+    throughput = change(old["throughput_rps"], new["throughput_rps"])
+    if check_throughput and throughput < -threshold:
+        problems.append(f"throughput {old['throughput_rps']:.1f} -> {new['throughput_rps']:.1f} ({throughput:.1f}%)")
+    if error_rate(new) - error_rate(old) > 0.01:
+        problems.append(f"error rate {error_rate(old):.1%} -> {error_rate(new):.1%}")
+    return problems
+
+
+def compare(base: dict, current: dict, threshold: float, min_delta_ms: float) -> tuple[list[str], dict]:
+    """
+    Возвращает строки таблицы для вывода и найденные регрессии по эндпоинтам
+    """
+    lines = [f"{'endpoint':45} " + " ".join(f"{key:>18}" for key in LATENCY_KEYS) + f" {'rps':>18}"]
+    regressions = {}
+    endpoints = {**base["endpoints"], **current["endpoints"]}
+    for endpoint in [*endpoints, "total"]:
+        old = base["total"] if endpoint == "total" else base["endpoints"].get(endpoint)
+        new = current["total"] if endpoint == "total" else current["endpoints"].get(endpoint)
+        if old is None or new is None:
+            lines.append(f"{endpoint:45} {'only in ' + ('current' if old is None else 'base'):>18}")
+            continue
+        cells = [f"{new[key]:>9.2f} {change(old[key], new[key]):>+7.1f}%" for key in LATENCY_KEYS]
+        cells.append(f"{new['throughput_rps']:>9.1f} {change(old['throughput_rps'], new['throughput_rps']):>+7.1f}%")
+        problems = compare_endpoint(old, new, threshold, min_delta_ms, check_throughput=endpoint == "total")
+        if problems:
+            regressions[endpoint] = problems
+        lines.append(f"{endpoint:45} " + " ".join(cells) + ("  REGRESSION" if problems else ""))
+    return lines, regressions
+
+
+def main(args) -> int:
+    with open(args.base, encoding="utf-8") as file:
+        base = json.load(file)
+    with open(args.current, encoding="utf-8") as file:
+        current = json.load(file)
+
+    for report, name in ((base, "base"), (current, "current")):
+        meta = report.get("meta", {})
+        print(f"{name}: commit {meta.get('git_commit')}, {meta.get('requests')} requests, "
+              f"concurrency {meta.get('concurrency')}, dataset {report.get('dataset', {}).get('notes')} notes")
+    if base.get("meta", {}).get("mix") != current.get("meta", {}).get("mix"):
+        print("warning: reports use different operation mixes")
+
+    lines, regressions = compare(base, current, args.threshold, args.min_delta_ms)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} endpoint(s) regressed by more than {args.threshold}%:")
+        for endpoint, problems in regressions.items():
+            print(f"  {endpoint}: {'; '.join(problems)}")
+        return 1
+    print("\nno regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed change in percent")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency changes smaller than this")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,83 @@
+"""
+Сжатие ответов: байты на проводе и процессорное время на запрос для страниц заметок разного размера.
+Для каждого размера страницы (--sizes, число заметок) и каждой кодировки ответ проходит через CompressionMiddleware
+--repeat раз, время процессора считается через process_time и делится на число запросов.
+identity - тот же ответ без сжатия, его время - накладные расходы самой мидлвары и ASGI.
+Приложение вызывается напрямую через ASGI, без сети и без БД. Запуск из корня репозитория:
+
+    python -m benchmarks.compression --sizes 1,10,50,200 --repeat 500
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from starlette.responses import Response
+
+from benchmarks.serialization import make_rows
+from compression import CompressionMiddleware
+from config import settings
+from notes.routers import encode_page, note_item
+
+
+async def call(app, accept_encoding: str) -> int:
+    scope = {"type": "http", "method": "GET", "path": "/notes", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    size = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal size
+        if message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return size
+
+
+async def measure(body: bytes, accept_encoding: str, repeat: int) -> dict:
+    async def endpoint(scope, receive, send):
+        await Response(body, media_type="application/json")(scope, receive, send)
+
+    app = CompressionMiddleware(endpoint,
+                                minimum_size=settings.COMPRESSION_MIN_SIZE,
+                                gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+                                brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+                                zstd_level=settings.COMPRESSION_ZSTD_LEVEL)
+    if accept_encoding != "identity" and accept_encoding not in app.encodings:
+        return {"skipped": "library is not installed"}
+    wire_bytes = await call(app, accept_encoding)
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        await call(app, accept_encoding)
+    cpu = time.process_time() - cpu_start
+    return {
+        "wire_bytes": wire_bytes,
+        "ratio": round(len(body) / wire_bytes, 2),
+        "cpu_us_per_request": round(cpu / repeat * 1_000_000, 1),
+    }
+
+
+async def main(args):
+    rows = make_rows(max(args.sizes), random.Random(args.seed))
+    results = {}
+    for size in args.sizes:
+        body = encode_page([note_item(row) for row in rows[:size]], None)
+        results[size] = {"body_bytes": len(body)}
+        for encoding in ("identity", "gzip", "br", "zstd"):
+            results[size][encoding] = await measure(body, encoding, args.repeat)
+    print(json.dumps({"repeat": args.repeat, "minimum_size": settings.COMPRESSION_MIN_SIZE,
+                      "levels": {"gzip": settings.COMPRESSION_GZIP_LEVEL, "br": settings.COMPRESSION_BROTLI_QUALITY,
+                                 "zstd": settings.COMPRESSION_ZSTD_LEVEL},
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[1, 10, 50, 200],
+                        help="notes per page, comma separated")
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
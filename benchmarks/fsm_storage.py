@@ -0,0 +1,64 @@
+"""
+Сравнение SQLiteStorage бота с MemoryStorage aiogram на операциях get/set состояния и данных.
+Каждая итерация имитирует шаг диалога: прочитать состояние, записать данные, сменить состояние.
+Запуск из корня репозитория, внешние сервисы не нужны:
+
+    python -m benchmarks.fsm_storage --users 1000 --steps 20 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from benchmarks.common import run_concurrently, summarize
+from tgbot_storage import SQLiteStorage
+
+BOT_ID = 1
+
+
+async def bench_storage(storage, args) -> dict:
+    keys = [StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id) for user_id in range(args.users)]
+    rnd = random.Random(args.seed)
+
+    async def step():
+        key = rnd.choice(keys)
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        await storage.set_data(key, {"title": "note", "step": data.get("step", 0) + 1})
+        await storage.set_state(key, "NoteForm:content")
+
+    latencies, elapsed = await run_concurrently(step, args.users * args.steps, args.concurrency)
+    await storage.close()
+    return summarize(latencies, elapsed)
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fsm.sqlite3")
+        results = {
+            "MemoryStorage": await bench_storage(MemoryStorage(), args),
+            "SQLiteStorage": await bench_storage(SQLiteStorage(path), args),
+            # без кэша каждое чтение идет в файл: так видно, сколько дает кэш горячих ключей
+            "SQLiteStorage (no cache)": await bench_storage(SQLiteStorage(path, cache_size=0), args),
+        }
+
+        # после close все изменения должны лежать в файле: новое хранилище видит состояние
+        storage = SQLiteStorage(path)
+        key = StorageKey(bot_id=BOT_ID, chat_id=0, user_id=0)
+        results["persisted_state"] = await storage.get_state(key)
+        await storage.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
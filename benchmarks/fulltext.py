@@ -0,0 +1,92 @@
+"""
+Полнотекстовый поиск против ILIKE на сгенерированном корпусе заметок.
+Заметки создаются у отдельного пользователя и удаляются после замера.
+Запуск из корня репозитория (нужны .env и Postgres с примененными миграциями):
+
+    python -m benchmarks.fulltext --notes 100000 --repeat 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from sqlalchemy import delete, insert, select
+
+from benchmarks.common import summarize
+from database import async_session_maker
+from notes.accessor import ContentManager
+from notes.models import Note
+from users.models import User
+
+WORDS = [f"word{i}" for i in range(5000)]
+
+
+def random_text(rnd: random.Random, length: int) -> str:
+    # частоты слов распределены неравномерно, как в живом тексте
+    return " ".join(WORDS[min(int(rnd.paretovariate(1.2)) - 1, len(WORDS) - 1)] for _ in range(length))
+
+
+async def seed(session, user_id: int, count: int, rnd: random.Random):
+    for start in range(0, count, 5000):
+        await session.execute(insert(Note), [
+            {"title": random_text(rnd, 5), "content": random_text(rnd, 80), "user_id": user_id, "revision": 0}
+            for _ in range(min(5000, count - start))
+        ])
+    await session.commit()
+
+
+async def measure(call, repeat: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call_start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def main(args):
+    rnd = random.Random(args.seed)
+    async with async_session_maker() as session:
+        user = User(email=f"bench-{uuid.uuid4().hex}@example.com", hashed_password="-")
+        session.add(user)
+        await session.commit()
+        try:
+            await seed(session, user.id, args.notes, rnd)
+            accessor = ContentManager(session)
+            queries = ["word3", "word10 word42", "word700", "word3 -word5"]
+            results = {}
+            for query in queries:
+                async def fts():
+                    await accessor.search_notes(query, user.id, limit=args.limit)
+
+                async def ilike():
+                    pattern = f"%{query.split()[0]}%"
+                    await session.execute(
+                        select(Note.id)
+                        .where(Note.user_id == user.id)
+                        .where(Note.content.ilike(pattern) | Note.title.ilike(pattern))
+                        .order_by(Note.updated_at.desc())
+                        .limit(args.limit)
+                    )
+
+                results[query] = {
+                    "fulltext": await measure(fts, args.repeat),
+                    "ilike": await measure(ilike, args.repeat),
+                }
+            print(json.dumps({"notes": args.notes, "results": results}, indent=2))
+        finally:
+            await session.execute(delete(Note).where(Note.user_id == user.id))
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notes", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,260 @@
+"""
+Нагрузочный тест апи на сгенерированных данных: вход по JWT, создание, список, поиск по тегам и тексту,
+облако тегов, изменение и удаление заметок, те же операции через хэндлеры бота /notes/tg/{telegram_id}.
+Операции выбираются случайно с весами из --mix, для каждой считаются p50/p95/p99 и пропускная способность,
+отчет сохраняется в json. Два отчета сравнивает benchmarks.compare.
+
+По умолчанию приложение вызывается в том же процессе через ASGI, с --base-url запросы идут
+в запущенный сервер (лимитер на нем нужно отключить: RATE_LIMIT_ENABLED=false).
+Кэш ответов и кэш пользователей в процессе отключаются, чтобы чтения доходили до Postgres;
+--caches оставляет их включенными. Для запущенного сервера то же делают
+RESPONSE_CACHE_ENABLED=false и AUTH_CACHE_ENABLED=false.
+Данные в обоих случаях создаются напрямую в БД из .env. Запуск из корня репозитория:
+
+    docker compose up -d postgres && (cd app && alembic upgrade head)
+    python -m benchmarks.load --users 100 --notes-per-user 200 --requests 5000 --concurrency 20 --output base.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+
+from benchmarks.common import run_concurrently, summarize
+from benchmarks.seed import Dataset, SeededUser, cleanup, random_text, seed, skewed_index
+
+DEFAULT_MIX = ("list=25,search=10,text_search=10,create=10,patch=10,delete=5,"
+               "tg_list=10,tg_search=5,tg_create=8,tg_patch=5,tg_delete=2")
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}. Available: {', '.join(OPERATIONS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+class LoadTest:
+    """
+    Состояние прогона: токены пользователей, созданные во время прогона заметки и замеры по эндпоинтам.
+    Удаляются только заметки, созданные в этом прогоне, поэтому исходный набор данных не меняется.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, dataset: Dataset, rnd: random.Random, active_users: int):
+        self.client = client
+        self.dataset = dataset
+        self.rnd = rnd
+        self.users = dataset.users[:active_users]
+        self.tokens: dict[int, str] = {}
+        self.created: dict[int, list[int]] = defaultdict(list)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def request(self, endpoint: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+        return response
+
+    async def auth(self, user: SeededUser) -> dict:
+        if user.id not in self.tokens:
+            response = await self.request("POST /users/auth/jwt/login", "POST", "/users/auth/jwt/login",
+                                          data={"username": user.email, "password": self.dataset.password})
+            if response is None or response.status_code != 200:
+                return {}
+            self.tokens[user.id] = response.json()["access_token"]
+        return {"Authorization": f"Bearer {self.tokens[user.id]}"}
+
+    def pick_user(self) -> SeededUser:
+        # активность пользователей тоже неравномерна
+        return self.users[skewed_index(self.rnd, len(self.users))]
+
+    def note_payload(self) -> dict:
+        tags = {self.dataset.tags[skewed_index(self.rnd, len(self.dataset.tags), 1.1)]
+                for _ in range(self.rnd.randint(0, 3))} if self.dataset.tags else set()
+        return {"title": random_text(self.rnd, 4), "content": random_text(self.rnd, 40), "tags": sorted(tags)}
+
+    def search_params(self) -> dict:
+        return {"any": [self.dataset.tags[skewed_index(self.rnd, len(self.dataset.tags), 1.1)]]}
+
+    def text_query(self) -> dict:
+        return {"q": random_text(self.rnd, 1)}
+
+    # ----------- операции -------------
+
+    async def op_list(self, user: SeededUser):
+        await self.request("GET /notes", "GET", "/notes", headers=await self.auth(user))
+
+    async def op_search(self, user: SeededUser):
+        await self.request("GET /notes/search", "GET", "/notes/search", params=self.search_params(),
+                           headers=await self.auth(user))
+
+    async def op_text_search(self, user: SeededUser):
+        await self.request("GET /notes/search/text", "GET", "/notes/search/text", params=self.text_query(),
+                           headers=await self.auth(user))
+
+    async def op_tags(self, user: SeededUser):
+        await self.request("GET /notes/tags", "GET", "/notes/tags", headers=await self.auth(user))
+
+    async def op_create(self, user: SeededUser):
+        response = await self.request("POST /notes", "POST", "/notes", json=self.note_payload(),
+                                      headers=await self.auth(user))
+        if response is not None and response.status_code == 201:
+            self.created[user.id].append(response.json()["id"])
+
+    async def op_patch(self, user: SeededUser):
+        note_id = self.rnd.choice(user.note_ids)
+        await self.request("PATCH /notes/{note_id}", "PATCH", f"/notes/{note_id}",
+                           json={"id": note_id, **self.note_payload()}, headers=await self.auth(user))
+
+    async def op_delete(self, user: SeededUser):
+        if not self.created[user.id]:
+            return await self.op_create(user)
+        note_id = self.created[user.id].pop()
+        await self.request("DELETE /notes/{note_id}", "DELETE", f"/notes/{note_id}", headers=await self.auth(user))
+
+    async def op_tg_list(self, user: SeededUser):
+        await self.request("GET /notes/tg/{telegram_id}", "GET", f"/notes/tg/{user.telegram_id}")
+
+    async def op_tg_search(self, user: SeededUser):
+        await self.request("GET /notes/tg/{telegram_id}/search", "GET", f"/notes/tg/{user.telegram_id}/search",
+                           params=self.search_params())
+
+    async def op_tg_tags(self, user: SeededUser):
+        await self.request("GET /notes/tg/{telegram_id}/tags", "GET", f"/notes/tg/{user.telegram_id}/tags")
+
+    async def op_tg_create(self, user: SeededUser):
+        response = await self.request("POST /notes/tg/{telegram_id}", "POST", f"/notes/tg/{user.telegram_id}",
+                                      json=self.note_payload())
+        if response is not None and response.status_code == 201:
+            self.created[user.id].append(response.json()["id"])
+
+    async def op_tg_patch(self, user: SeededUser):
+        note_id = self.rnd.choice(user.note_ids)
+        await self.request("PATCH /notes/tg/{telegram_id}/{note_id}", "PATCH",
+                           f"/notes/tg/{user.telegram_id}/{note_id}", json={"id": note_id, **self.note_payload()})
+
+    async def op_tg_delete(self, user: SeededUser):
+        if not self.created[user.id]:
+            return await self.op_tg_create(user)
+        note_id = self.created[user.id].pop()
+        await self.request("DELETE /notes/tg/{telegram_id}/{note_id}", "DELETE",
+                           f"/notes/tg/{user.telegram_id}/{note_id}")
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint in sorted(self.latencies):
+            latencies = self.latencies[endpoint]
+            endpoints[endpoint] = {**summarize(latencies, elapsed), "errors": self.errors.get(endpoint, 0)}
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        return {"endpoints": endpoints,
+                "total": {**summarize(everything, elapsed), "errors": sum(self.errors.values())}}
+
+
+OPERATIONS = {name.removeprefix("op_"): getattr(LoadTest, name) for name in dir(LoadTest) if name.startswith("op_")}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    dataset = await seed(args.users, args.notes_per_user, args.tags, args.seed)
+    rnd = random.Random(args.seed)
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+    else:
+        # приложение импортируется только для прогона в том же процессе
+        from limiter import limiter
+        from main import app
+        from notes.cache import response_cache
+        from users.principals import principal_cache
+        limiter.enabled = False
+        response_cache.enabled = args.caches
+        principal_cache.enabled = args.caches
+        # ошибки приложения считаются как ответы 500, а не прерывают прогон
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+                                   base_url="http://load",
+                                   timeout=args.timeout)
+
+    try:
+        async with client:
+            test = LoadTest(client, dataset, rnd, min(args.active_users, len(dataset.users)))
+
+            async def call():
+                operation = OPERATIONS[rnd.choices(names, weights)[0]]
+                await operation(test, test.pick_user())
+
+            _, elapsed = await run_concurrently(call, args.requests, args.concurrency)
+            result = test.report(elapsed)
+    finally:
+        if not args.keep_data:
+            await cleanup(dataset.run_id)
+
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "target": args.base_url or "in-process",
+            "caches": args.caches if not args.base_url else None,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "active_users": len(test.users),
+            "mix": mix,
+            "seed": args.seed,
+        },
+        "dataset": dataset.summary(),
+        **result,
+    }
+
+
+async def main(args):
+    report = await run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--notes-per-user", type=int, default=200)
+    parser.add_argument("--tags", type=int, default=500)
+    parser.add_argument("--active-users", type=int, default=50, help="users that send requests during the run")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. list=5,create=1")
+    parser.add_argument("--base-url", help="send requests to a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the json report to this file")
+    parser.add_argument("--keep-data", action="store_true", help="do not delete seeded data after the run")
+    parser.add_argument("--caches", action="store_true",
+                        help="keep the in-process response and user caches enabled")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""
+Проверка, что стоимость create_note не зависит от заметок других пользователей.
+Другой пользователь получает все больше заметок с популярным тегом, после каждого шага замеряется
+создание заметки с этим тегом: число SQL-выражений, число объектов в сессии и время.
+Выражения и объекты должны совпадать на всех шагах, иначе скрипт завершается с кодом 1 (его можно запускать в CI).
+Данные создаются у отдельных пользователей и удаляются после замера.
+Запуск из корня репозитория (нужны .env и Postgres с примененными миграциями):
+
+    python -m benchmarks.note_creation --others 0,1000,10000,100000 --repeat 50
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+from sqlalchemy import delete, insert, select
+
+from benchmarks.common import summarize
+from database import async_session_maker
+from notes.accessor import ContentManager
+from notes.models import DeletedNote, Note, NoteRevision, NoteTag, Tag, UserTagStat
+from notes.schemas import NoteCreate
+from testing import count_queries
+from users.models import User
+
+
+async def add_other_notes(user_id: int, tag_id: int, count: int):
+    async with async_session_maker() as session:
+        for start in range(0, count, 5000):
+            note_ids = (await session.scalars(
+                insert(Note).returning(Note.id),
+                [{"title": "other", "content": "other note", "user_id": user_id, "revision": 0}
+                 for _ in range(min(5000, count - start))],
+            )).all()
+            await session.execute(insert(NoteTag), [{"note_id": note_id, "tag_id": tag_id} for note_id in note_ids])
+        await session.commit()
+
+
+async def measure(user_id: int, tag: str, repeat: int) -> dict:
+    latencies = []
+    statements = set()
+    loaded = set()
+    start = time.perf_counter()
+    for number in range(repeat):
+        async with async_session_maker() as session:
+            with count_queries() as counter:
+                call_start = time.perf_counter()
+                note = await ContentManager(session).create_note(
+                    NoteCreate(title="bench", content="bench", tags=[tag, f"{tag}-{number}"]), user_id
+                )
+                latencies.append(time.perf_counter() - call_start)
+            statements.add(counter.count)
+            # identity map хранит слабые ссылки, note держит заметку и ее теги до подсчета
+            loaded.add(len(session.identity_map))
+            del note
+    return {**summarize(latencies, time.perf_counter() - start),
+            "statements": sorted(statements), "loaded_objects": sorted(loaded)}
+
+
+async def cleanup(user_ids: list[int], tag: str):
+    async with async_session_maker() as session:
+        note_ids = select(Note.id).where(Note.user_id.in_(user_ids))
+        await session.execute(delete(NoteTag).where(NoteTag.note_id.in_(note_ids)))
+        await session.execute(delete(Note).where(Note.user_id.in_(user_ids)))
+        await session.execute(delete(DeletedNote).where(DeletedNote.user_id.in_(user_ids)))
+        await session.execute(delete(UserTagStat).where(UserTagStat.user_id.in_(user_ids)))
+        await session.execute(delete(NoteRevision).where(NoteRevision.user_id.in_(user_ids)))
+        await session.execute(delete(Tag).where(Tag.name.startswith(tag)))
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        await session.commit()
+
+
+async def main(args) -> int:
+    run_id = uuid.uuid4().hex[:8]
+    tag = f"bench-{run_id}-todo"
+    async with async_session_maker() as session:
+        user = User(email=f"bench-{run_id}@example.com", hashed_password="-")
+        other = User(email=f"bench-{run_id}-other@example.com", hashed_password="-")
+        popular = Tag(name=tag)
+        session.add_all([user, other, popular])
+        await session.commit()
+
+    results = {}
+    try:
+        current = 0
+        for size in sorted(int(value) for value in args.others.split(",")):
+            await add_other_notes(other.id, popular.id, size - current)
+            current = size
+            results[size] = await measure(user.id, tag, args.repeat)
+    finally:
+        await cleanup([user.id, other.id], tag)
+
+    print(json.dumps({"repeat": args.repeat, "results": results}, indent=2))
+    statements = {tuple(result["statements"]) for result in results.values()}
+    loaded = {tuple(result["loaded_objects"]) for result in results.values()}
+    if len(statements) > 1 or len(loaded) > 1:
+        print("create_note depends on the number of notes other users have")
+        return 1
+    print("create_note cost does not depend on other users' notes")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--others", default="0,1000,10000", help="notes of the other user with the popular tag")
+    parser.add_argument("--repeat", type=int, default=50)
+    sys.exit(asyncio.run(main(parser.parse_args())))
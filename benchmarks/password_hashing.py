@@ -0,0 +1,86 @@
+"""
+Задержка дешевого чтения во время всплеска входов: проверка пароля прямо в event loop (как в fastapi-users
+по умолчанию) против проверки в password_pool. Во время замера --logins клиентов непрерывно входят,
+а один клиент каждые --interval мс читает эндпоинт, который не трогает БД.
+Приложение вызывается напрямую через ASGI, без сети и без БД. Запуск из корня репозитория:
+
+    python -m benchmarks.password_hashing --logins 8 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from benchmarks.common import summarize
+from users.passwords import password_helper, password_pool
+
+PASSWORD = "benchmark-password"
+
+
+def make_app(hashed_password: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/login/inline")
+    async def login_inline():
+        verified, _ = password_helper.verify_and_update(PASSWORD, hashed_password)
+        return {"verified": verified}
+
+    @app.post("/login/pool")
+    async def login_pool():
+        verified, _ = await password_pool.verify_and_update(PASSWORD, hashed_password)
+        return {"verified": verified}
+
+    @app.get("/read")
+    async def read():
+        return {"notes": []}
+
+    return app
+
+
+async def storm(client: httpx.AsyncClient, mode: str, logins: int, seconds: float, interval: float) -> dict:
+    deadline = time.perf_counter() + seconds
+    login_latencies = []
+    read_latencies = []
+
+    async def login_worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.post(f"/login/{mode}")
+            if response.status_code == 200:
+                login_latencies.append(time.perf_counter() - start)
+
+    async def reader():
+        # задержка считается от запланированного времени запроса, а не от фактического:
+        # пока event loop занят хэшем, запрос не может даже начаться, и это тоже ожидание клиента
+        scheduled = time.perf_counter()
+        while scheduled < deadline:
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            await client.get("/read")
+            read_latencies.append(time.perf_counter() - scheduled)
+            scheduled += interval
+
+    start = time.perf_counter()
+    await asyncio.gather(reader(), *(login_worker() for _ in range(logins if mode != "idle" else 0)))
+    elapsed = time.perf_counter() - start
+    return {"read": summarize(read_latencies, elapsed), "login": summarize(login_latencies, elapsed)}
+
+
+async def main(args):
+    app = make_app(password_helper.hash(PASSWORD))
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for mode in ("idle", "inline", "pool"):
+            results[mode] = await storm(client, mode, args.logins, args.seconds, args.interval / 1000)
+    password_pool.shutdown()
+    print(json.dumps({"logins": args.logins, "workers": password_pool.max_workers, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=8, help="concurrent clients that keep logging in")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--interval", type=float, default=5.0, help="pause between reads, ms")
+    asyncio.run(main(parser.parse_args()))
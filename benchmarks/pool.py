@@ -0,0 +1,67 @@
+"""
+Сравнение NullPool и пула соединений на GET /notes.
+Кэш ответов и кэш пользователей отключены, иначе повторные GET /notes отдаются из памяти
+и не берут соединение из пула, а замер показывает кэш, а не пул.
+Запуск из корня репозитория (нужны .env и поднятый Postgres, у пользователя должны быть заметки):
+
+    python -m benchmarks.pool --user-id 1 --requests 1000 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from benchmarks.common import run_concurrently, summarize
+from database import create_engine, get_async_session
+from limiter import limiter
+from main import app
+from notes.cache import response_cache
+from users.auth import current_user
+from users.principals import principal_cache
+
+
+async def bench_engine(nullpool: bool, args) -> dict:
+    engine = create_engine(nullpool=nullpool)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+
+    async def get_bench_session():
+        async with session_maker() as session:
+            yield session
+
+    app.dependency_overrides[get_async_session] = get_bench_session
+    app.dependency_overrides[current_user] = lambda: SimpleNamespace(id=args.user_id)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def call():
+            response = await client.get("/notes")
+            response.raise_for_status()
+
+        # прогрев: первые соединения и подготовленные выражения не должны попадать в замер
+        await run_concurrently(call, args.concurrency, args.concurrency)
+        latencies, elapsed = await run_concurrently(call, args.requests, args.concurrency)
+
+    await engine.dispose()
+    app.dependency_overrides.clear()
+    return summarize(latencies, elapsed)
+
+
+async def main(args):
+    limiter.enabled = False
+    response_cache.enabled = False
+    principal_cache.enabled = False
+    results = {
+        "NullPool": await bench_engine(True, args),
+        "QueuePool": await bench_engine(False, args),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""
+Накладные расходы лога запросов на один запрос: без лога, прежняя мидлвара (@app.middleware("http"),
+f-строки и синхронная запись) и RequestLogMiddleware с фоновой записью json.
+Приложение вызывается напрямую через ASGI, без сети и без БД. Логи пишутся во временную папку.
+Запуск из корня репозитория:
+
+    python -m benchmarks.request_logging --requests 20000
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from fastapi import FastAPI, Request
+from loguru import logger
+
+from benchmarks.common import summarize
+from logger import RequestLogMiddleware, setup_logging, stop_logging
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/notes/tg/{telegram_id}")
+    async def endpoint(telegram_id: int):
+        return {"telegram_id": telegram_id}
+
+    return app
+
+
+def add_legacy_logging(app: FastAPI, log_dir: str, console):
+    # так лог запросов был устроен раньше: синхронные приемники и две записи на запрос
+    logger.remove()
+    logger.add(console, format="{time} {level} {message}", level="INFO", colorize=True)
+    logger.add(os.path.join(log_dir, "legacy.log"), rotation="00:00", retention="10 days", compression="zip")
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        logger.info(f"Request: {request.method} {request.url}")
+        try:
+            response = await call_next(request)
+            logger.info(f"Response status: {response.status_code}")
+            return response
+        except Exception as e:
+            logger.error(f"Error during request: {request.method} {request.url} - {e}")
+            raise
+
+
+async def call(app, path: str):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, requests: int) -> dict:
+    for number in range(100):
+        await call(app, f"/notes/tg/{number}")
+    latencies = []
+    start = time.perf_counter()
+    for number in range(requests):
+        call_start = time.perf_counter()
+        await call(app, f"/notes/tg/{number}")
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def main(args):
+    # консольный вывод уходит в буфер, чтобы не мерить скорость терминала
+    console = io.StringIO()
+    with tempfile.TemporaryDirectory() as log_dir:
+        logger.remove()
+        results = {"no logging": await measure(make_app(), args.requests)}
+
+        app = make_app()
+        add_legacy_logging(app, log_dir, console)
+        results["legacy middleware"] = await measure(app, args.requests)
+
+        for sample_rate in (1.0, 0.1):
+            setup_logging(log_dir, console=console)
+            app = make_app()
+            app.add_middleware(RequestLogMiddleware, sample_rate=sample_rate)
+            results[f"RequestLogMiddleware sample_rate={sample_rate}"] = await measure(app, args.requests)
+        logger.remove()
+        stop_logging()
+
+    base = results["no logging"]["mean_ms"]
+    for name, result in results.items():
+        result["overhead_us"] = round((result["mean_ms"] - base) * 1000, 1)
+    print(json.dumps(results, indent=2), file=sys.stdout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,159 @@
+"""
+Генерация воспроизводимого набора данных для нагрузочного теста: пользователи, заметки и теги.
+Распределения неравномерные, как в живых данных: у небольшой части пользователей большая часть заметок,
+несколько тегов встречаются намного чаще остальных. Данные пишутся напрямую через модели приложения,
+все записи помечены run_id и удаляются через cleanup. Запуск из корня репозитория
+(нужны .env и Postgres с примененными миграциями):
+
+    python -m benchmarks.seed --users 100 --notes-per-user 200 --tags 500
+    python -m benchmarks.seed --cleanup <run_id>
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+
+from fastapi_users.password import PasswordHelper
+from sqlalchemy import delete, insert, select
+
+import benchmarks.common  # noqa: F401 - добавляет app/ в sys.path
+from database import async_session_maker
+from notes.models import DeletedNote, Note, NoteRevision, NoteTag, Tag, UserTagStat
+from users.models import User
+
+PASSWORD = "load-test-password"
+WORDS = [f"word{i}" for i in range(5000)]
+# telegram_id - Integer в БД, берем id из верхней части диапазона, где нет настоящих пользователей
+TELEGRAM_ID_BASE = 1_900_000_000
+CHUNK = 5000
+
+
+@dataclass
+class SeededUser:
+    id: int
+    email: str
+    telegram_id: int
+    note_ids: list[int] = field(default_factory=list)
+
+
+@dataclass
+class Dataset:
+    run_id: str
+    password: str
+    users: list[SeededUser]
+    tags: list[str]
+
+    def summary(self) -> dict:
+        notes = sorted(len(user.note_ids) for user in self.users)
+        return {"run_id": self.run_id, "users": len(self.users), "tags": len(self.tags),
+                "notes": sum(notes), "max_notes_per_user": notes[-1] if notes else 0,
+                "median_notes_per_user": notes[len(notes) // 2] if notes else 0}
+
+
+def skewed_index(rnd: random.Random, size: int, alpha: float = 1.2) -> int:
+    # индекс с распределением Парето: первые элементы выпадают намного чаще
+    return min(int(rnd.paretovariate(alpha)) - 1, size - 1)
+
+
+def random_text(rnd: random.Random, length: int) -> str:
+    return " ".join(WORDS[skewed_index(rnd, len(WORDS))] for _ in range(length))
+
+
+def notes_per_user(rnd: random.Random, users: int, total: int) -> list[int]:
+    # правило 80/20: веса пользователей по Парето, у каждого хотя бы одна заметка
+    weights = [rnd.paretovariate(1.16) for _ in range(users)]
+    scale = max(total - users, 0) / sum(weights)
+    return [1 + int(weight * scale) for weight in weights]
+
+
+async def seed(users: int, notes_per_user_mean: int, tags: int, seed_value: int = 42) -> Dataset:
+    rnd = random.Random(seed_value)
+    run_id = uuid.uuid4().hex[:8]
+    hashed_password = PasswordHelper().hash(PASSWORD)
+    tag_names = [f"{run_id}-tag{i}" for i in range(tags)]
+    counts = notes_per_user(rnd, users, users * notes_per_user_mean)
+    telegram_ids = rnd.sample(range(TELEGRAM_ID_BASE, TELEGRAM_ID_BASE + 100_000_000), users)
+
+    async with async_session_maker() as session:
+        rows = await session.execute(
+            insert(User).returning(User.id, User.email, User.telegram_id, sort_by_parameter_order=True),
+            [{"email": f"load-{run_id}-{number}@example.com", "hashed_password": hashed_password,
+              "telegram_id": telegram_ids[number], "is_active": True, "is_superuser": False, "is_verified": True}
+             for number in range(users)],
+        )
+        seeded = [SeededUser(id=row.id, email=row.email, telegram_id=row.telegram_id) for row in rows]
+        tag_ids = {}
+        if tag_names:
+            rows = await session.execute(insert(Tag).returning(Tag.id, Tag.name), [{"name": name} for name in tag_names])
+            tag_ids = {row.name: row.id for row in rows}
+
+        # счетчики облака тегов и ревизии приложение ведет само, здесь заметки пишутся в обход него:
+        # все заметки пользователя получают ревизию 1
+        tag_stats = Counter()
+        pending = [(user, number) for user, count in zip(seeded, counts) for number in range(count)]
+        for start in range(0, len(pending), CHUNK):
+            chunk = pending[start:start + CHUNK]
+            note_ids = list(await session.scalars(
+                insert(Note).returning(Note.id, sort_by_parameter_order=True),
+                [{"title": random_text(rnd, 5), "content": random_text(rnd, 60), "user_id": user.id, "revision": 1}
+                 for user, _ in chunk],
+            ))
+            links = []
+            for (user, _), note_id in zip(chunk, note_ids):
+                user.note_ids.append(note_id)
+                if tag_names:
+                    chosen = {tag_names[skewed_index(rnd, len(tag_names), 1.1)] for _ in range(rnd.randint(0, 5))}
+                    links.extend({"note_id": note_id, "tag_id": tag_ids[name]} for name in chosen)
+                    tag_stats.update((user.id, tag_ids[name]) for name in chosen)
+            if links:
+                await session.execute(insert(NoteTag), links)
+        if tag_stats:
+            await session.execute(insert(UserTagStat), [{"user_id": user_id, "tag_id": tag_id, "note_count": count}
+                                                        for (user_id, tag_id), count in tag_stats.items()])
+        revisions = [{"user_id": user.id, "revision": 1} for user, count in zip(seeded, counts) if count]
+        if revisions:
+            await session.execute(insert(NoteRevision), revisions)
+        await session.commit()
+    return Dataset(run_id=run_id, password=PASSWORD, users=seeded, tags=tag_names)
+
+
+async def cleanup(run_id: str):
+    """
+    Удаляет пользователей, заметки и теги, созданные seed с этим run_id
+    """
+    async with async_session_maker() as session:
+        user_ids = select(User.id).where(User.email.like(f"load-{run_id}-%"))
+        note_ids = select(Note.id).where(Note.user_id.in_(user_ids))
+        await session.execute(delete(NoteTag).where(NoteTag.note_id.in_(note_ids)))
+        await session.execute(delete(Note).where(Note.user_id.in_(user_ids)))
+        await session.execute(delete(DeletedNote).where(DeletedNote.user_id.in_(user_ids)))
+        await session.execute(delete(UserTagStat).where(UserTagStat.user_id.in_(user_ids)))
+        await session.execute(delete(NoteRevision).where(NoteRevision.user_id.in_(user_ids)))
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        tag_ids = select(Tag.id).where(Tag.name.like(f"{run_id}-tag%"))
+        await session.execute(delete(NoteTag).where(NoteTag.tag_id.in_(tag_ids)))
+        await session.execute(delete(UserTagStat).where(UserTagStat.tag_id.in_(tag_ids)))
+        await session.execute(delete(Tag).where(Tag.id.in_(tag_ids)))
+        await session.commit()
+
+
+async def main(args):
+    if args.cleanup:
+        await cleanup(args.cleanup)
+        return
+    dataset = await seed(args.users, args.notes_per_user, args.tags, args.seed)
+    print(json.dumps(dataset.summary() if not args.full else asdict(dataset), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--notes-per-user", type=int, default=200)
+    parser.add_argument("--tags", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--full", action="store_true", help="print every user with note ids")
+    parser.add_argument("--cleanup", metavar="RUN_ID", help="delete data seeded with this run_id")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""
+Стоимость сборки страницы списка в байты json на 1000 заметок:
+- orm_pydantic: как было раньше - объекты Note с тегами из ORM, модели NoteResponse и model_dump_json;
+- rows_pydantic: строки с колонками и массивом тегов, но сериализация по-прежнему через pydantic;
+- rows_orjson: строки и orjson, как сейчас собираются notes_page/tag_search_page/text_search_page.
+БД не нужна: объекты и строки создаются в памяти. Запуск из корня репозитория:
+
+    python -m benchmarks.serialization --notes 1000 --repeat 200
+"""
+import argparse
+import json
+import random
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import summarize
+from benchmarks.seed import random_text
+from notes.models import Note, Tag
+from notes.routers import encode_page, note_item
+from notes.schemas import NotePage, NoteResponse
+
+NoteRow = namedtuple("NoteRow", "id title content created_at updated_at tags")
+
+
+def make_rows(count: int, rnd: random.Random) -> list[NoteRow]:
+    now = datetime.now(timezone.utc)
+    tags = [f"tag{i}" for i in range(50)]
+    return [NoteRow(id=i,
+                    title=random_text(rnd, 4),
+                    content=random_text(rnd, 40),
+                    created_at=now - timedelta(minutes=i),
+                    updated_at=now - timedelta(seconds=i),
+                    tags=sorted(rnd.sample(tags, rnd.randint(0, 3))) or None)
+            for i in range(count)]
+
+
+def make_notes(rows: list[NoteRow]) -> list[Note]:
+    tags = {}
+    notes = []
+    for row in rows:
+        note = Note(id=row.id, title=row.title, content=row.content,
+                    created_at=row.created_at, updated_at=row.updated_at)
+        note.tags = [tags.setdefault(name, Tag(name=name)) for name in row.tags or []]
+        notes.append(note)
+    return notes
+
+
+def orm_pydantic(notes: list[Note]) -> bytes:
+    return NotePage(items=[NoteResponse(
+        id=note.id,
+        title=note.title,
+        content=note.content,
+        created_at=note.created_at,
+        updated_at=note.updated_at,
+        tags=[tag.name for tag in note.tags]
+    ) for note in notes], next_cursor=None).model_dump_json().encode()
+
+
+def rows_pydantic(rows: list[NoteRow]) -> bytes:
+    return NotePage(items=[NoteResponse(**note_item(row)) for row in rows], next_cursor=None).model_dump_json().encode()
+
+
+def rows_orjson(rows: list[NoteRow]) -> bytes:
+    return encode_page([note_item(row) for row in rows], None)
+
+
+def measure(func, data, repeat: int) -> dict:
+    func(data)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        timings.append(time.perf_counter() - start)
+    return summarize(timings, sum(timings))
+
+
+def main(args):
+    rows = make_rows(args.notes, random.Random(args.seed))
+    notes = make_notes(rows)
+    assert orm_pydantic(notes) == rows_pydantic(rows) == rows_orjson(rows)
+
+    results = {
+        "orm_pydantic": measure(orm_pydantic, notes, args.repeat),
+        "rows_pydantic": measure(rows_pydantic, rows, args.repeat),
+        "rows_orjson": measure(rows_orjson, rows, args.repeat),
+    }
+    for result in results.values():
+        # замер - одна страница из --notes заметок, пересчитываем на 1000 заметок
+        result["per_1000_notes_ms"] = round(result["p50_ms"] * 1000 / args.notes, 3)
+    print(json.dumps({"notes": args.notes, "page_bytes": len(rows_orjson(rows)), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -1,18 +1,26 @@
 import asyncio
+import html
+import importlib.util
 import logging
 import os
+import random
+import secrets
 import sys
-from typing import Callable, Awaitable, Any
+import time
+from collections import OrderedDict
+from typing import Callable, Awaitable, Any, Hashable, Optional
 import httpx
 from email_validator import validate_email, EmailNotValidError  # Import the validator
 from aiogram import Bot, Dispatcher, Router, BaseMiddleware, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.filters import Command, StateFilter
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, ExceptionTypeFilter, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, Update, CallbackQuery
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, Update, CallbackQuery, ErrorEvent
+from tgbot_storage import SQLiteStorage
 
 # from config import settings
 # # API_TOKEN = settings.API_TOKEN
@@ -22,10 +30,34 @@ from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, U
 # используем переменные окружения, чтобы получить константные данные
 API_TOKEN = os.getenv("API_TOKEN")
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://fastapi-app:8000/")
+# кэш связанных аккаунтов: сколько пользователей помним и как долго верим положительному и отрицательному ответу
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_POSITIVE_TTL = float(os.getenv("USER_CACHE_POSITIVE_TTL", 600))
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", 30))
+# настройки клиента апи: таймаут по умолчанию, повторы для GET и порог срабатывания предохранителя
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", 5))
+API_RETRIES = int(os.getenv("API_RETRIES", 2))
+API_FAILURE_THRESHOLD = int(os.getenv("API_FAILURE_THRESHOLD", 5))
+API_RESET_TIMEOUT = float(os.getenv("API_RESET_TIMEOUT", 30))
+# апи сжимает ответы: просим br, если httpx может его распаковать (нужен пакет brotli), иначе gzip
+API_ACCEPT_ENCODING = "br, gzip" if importlib.util.find_spec("brotli") else "gzip"
+# хранилище состояний диалогов: sqlite переживает перезапуск и может быть общим для нескольких процессов бота
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "data/fsm.sqlite3")
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", 7 * 24 * 3600))
+# постраничный просмотр заметок: заметок на странице, сколько отрисованных страниц помним и сколько секунд
+NOTES_PAGE_SIZE = int(os.getenv("NOTES_PAGE_SIZE", 5))
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 1000))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", 60))
+# ограничение телеграма на длину текста сообщения
+MESSAGE_LIMIT = 4096
 
 # инициализация бота
 bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-storage = MemoryStorage()
+if FSM_STORAGE == "memory":
+    storage = MemoryStorage()
+else:
+    storage = SQLiteStorage(FSM_STORAGE_PATH, state_ttl=FSM_STATE_TTL)
 dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
@@ -42,6 +74,159 @@ class LinkEmailForm(StatesGroup):
     email = State()
 
 
+class TTLCache:
+    """
+    Кэш ограниченного размера: у каждой записи свое время жизни,
+    при переполнении вытесняется запись, которую дольше всех не читали
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None or item[1] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+
+# телеграм ид -> связан ли аккаунт
+linked_users = TTLCache(maxsize=USER_CACHE_SIZE)
+# (чат, ид списка, номер страницы) -> отрисованная страница с клавиатурой
+rendered_pages = TTLCache(maxsize=PAGE_CACHE_SIZE)
+
+
+class ApiUnavailable(Exception):
+    """
+    Апи не отвечает: предохранитель разомкнут или все попытки закончились ошибкой соединения
+    """
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд перестаем ходить в апи на reset_timeout секунд,
+    затем пропускаем один пробный запрос. Успех замыкает предохранитель, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self._probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def end_probe(self):
+        # пробный запрос мог прерваться без ответа (отмена, ошибка распаковки) - следующий снова станет пробным
+        self._probing = False
+
+
+class ApiClient:
+    """
+    Общий для всего бота клиент апи: один пул соединений с keep-alive вместо нового клиента на каждый запрос.
+    Идемпотентные GET повторяются с экспоненциальной задержкой и случайным разбросом,
+    при недоступности апи предохранитель сразу отвечает ApiUnavailable, не копя зависшие запросы.
+    Недоступностью считаются только ошибки соединения и 502/503/504: прочие 5xx - ошибка конкретного
+    запроса (например, данных одного пользователя), их не повторяем и предохранитель из-за них не размыкаем.
+    """
+
+    UNAVAILABLE_STATUSES = (502, 503, 504)
+
+    def __init__(self, base_url: str, timeout: float, retries: int, breaker: CircuitBreaker):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = breaker
+        self._client = None
+
+    async def start(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 2.0)),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30),
+                headers={"Accept-Encoding": API_ACCEPT_ENCODING},
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, url: str, retry: bool = None, timeout: float = None, **kwargs) -> httpx.Response:
+        if retry is None:
+            retry = method == "GET"
+        attempts = 1 + (self.retries if retry else 0)
+        error = None
+        for attempt in range(attempts):
+            probe = self.breaker.opened_at is not None
+            if not self.breaker.allow():
+                raise ApiUnavailable(url)
+            try:
+                response = await self._client.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                error = e
+            else:
+                if response.status_code not in self.UNAVAILABLE_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt == attempts - 1:
+                    return response
+            finally:
+                if probe:
+                    self.breaker.end_probe()
+            if attempt < attempts - 1:
+                await asyncio.sleep(random.uniform(0, 0.2 * 2 ** attempt))
+        raise ApiUnavailable(url) from error
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+
+api = ApiClient(FASTAPI_URL, timeout=API_TIMEOUT, retries=API_RETRIES,
+                breaker=CircuitBreaker(API_FAILURE_THRESHOLD, API_RESET_TIMEOUT))
+
+
 async def check_user_existence(user_id: int):
     """
     функция, проверяющая через апи - существует ли пользователь в БД
@@ -49,13 +234,23 @@ async def check_user_existence(user_id: int):
     :param user_id:
     :return: dict
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{FASTAPI_URL}users/auth/exist", params={
-            "telegram_id": user_id
-        })
+    # проверка выполняется перед каждым хэндлером, поэтому таймаут короче обычного
+    response = await api.get("users/auth/exist", params={"telegram_id": user_id}, timeout=2.0)
     return response.json()
 
 
+async def is_user_linked(user_id: int) -> bool:
+    """
+    Проверка связки аккаунтов с кэшем: для уже связанных пользователей обращения к апи нет.
+    Отрицательный ответ хранится недолго, чтобы только что связанный в другом месте аккаунт быстро заработал.
+    """
+    linked = linked_users.get(user_id)
+    if linked is None:
+        linked = bool(await check_user_existence(user_id))
+        linked_users.set(user_id, linked, USER_CACHE_POSITIVE_TTL if linked else USER_CACHE_NEGATIVE_TTL)
+    return linked
+
+
 class UserCheckMiddleware(BaseMiddleware):
     """
     Мидлвара для бота - проверяет авторизован ли пользователь, если да - пропускаем дальше.
@@ -68,12 +263,13 @@ class UserCheckMiddleware(BaseMiddleware):
 
         if isinstance(event, Message):
             user = event.from_user
-            db_user = await check_user_existence(user.id)
+            if await is_user_linked(user.id):
+                return await handler(event, data)
 
             fsm_context = data.get('state', None)
             state = await fsm_context.get_state() if fsm_context else None
 
-            if db_user or state == LinkEmailForm.email.state:
+            if state == LinkEmailForm.email.state:
                 return await handler(event, data)
 
             await event.answer(
@@ -104,6 +300,107 @@ inline_kb = InlineKeyboardMarkup(inline_keyboard=[
 ])
 
 
+"""
+Постраничный просмотр заметок. Список (все заметки или результат поиска) получает случайный ид,
+в данных состояния храним ид текущего списка, адрес апи и курсоры уже открытых страниц.
+Кнопки листания несут ид списка и номер страницы: pg:<ид>:<страница>. Запрашиваем у апи только
+нужную страницу, сообщение редактируем на месте, отрисованные страницы недолго кэшируем.
+"""
+NOTE_TEMPLATE = "Title: {title}\nContent: {content}\nTags: {tags}"
+
+
+def shorten(text: str, room: int) -> str:
+    """
+    Экранирует текст для html и обрезает до room символов с многоточием, не разрывая html-сущность вроде &amp;
+    """
+    text = html.escape(text)
+    if len(text) <= room:
+        return text
+    if room <= 0:
+        return ""
+    text = text[:room - 1]
+    amp = text.rfind('&')
+    if amp != -1 and ';' not in text[amp:]:
+        text = text[:amp]
+    return text + "…"
+
+
+def render_note(note: dict, limit: int) -> str:
+    """
+    Заметка не длиннее limit символов: заголовку и тегам достается не больше четверти места каждому,
+    остальное и то, что они не заняли, - тексту
+    """
+    room = max(limit - len(NOTE_TEMPLATE.format(title="", content="", tags="")), 0)
+    title = shorten(note['title'], room // 4)
+    tags = shorten(', '.join(note['tags']), room // 4)
+    content = shorten(note['content'], room - len(title) - len(tags))
+    return NOTE_TEMPLATE.format(title=title, content=content, tags=tags)
+
+
+def render_page(header: str, notes: list[dict], page: int) -> str:
+    header = f"{header} (page {page + 1}):"
+    # каждой заметке - равная доля лимита за вычетом разделителя, так что страница всегда укладывается в лимит
+    # и ни одна заметка не пропадает: слишком длинная показывается обрезанной
+    per_note = (MESSAGE_LIMIT - len(header)) // max(len(notes), 1) - 2
+    return "\n\n".join([header] + [render_note(note, per_note) for note in notes])
+
+
+def pagination_kb(list_id: str, page: int, has_next: bool) -> Optional[InlineKeyboardMarkup]:
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text='« Prev', callback_data=f'pg:{list_id}:{page - 1}'))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text='Next »', callback_data=f'pg:{list_id}:{page + 1}'))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+async def get_page(state: FSMContext, chat_id: int, notes_list: dict, page: int):
+    """
+    Отрисованная страница списка: из кэша или одним запросом к апи по сохраненному курсору.
+    :return: (текст, клавиатура), пустой текст - на странице нет заметок, None - апи вернуло ошибку
+    """
+    key = (chat_id, notes_list['id'], page)
+    rendered = rendered_pages.get(key)
+    if rendered is not None:
+        return rendered
+
+    params = dict(notes_list['params'], limit=NOTES_PAGE_SIZE)
+    if notes_list['cursors'][page]:
+        params['cursor'] = notes_list['cursors'][page]
+    response = await api.get(notes_list['url'], params=params)
+    if response.status_code != 200:
+        return None
+    body = response.json()
+
+    if body['next_cursor'] and len(notes_list['cursors']) == page + 1:
+        notes_list['cursors'].append(body['next_cursor'])
+        await state.update_data(notes_list=notes_list)
+
+    if not body['items']:
+        rendered = ("", None)
+    else:
+        rendered = (render_page(notes_list['header'], body['items'], page),
+                    pagination_kb(notes_list['id'], page, bool(body['next_cursor'])))
+    rendered_pages.set(key, rendered, PAGE_CACHE_TTL)
+    return rendered
+
+
+async def open_notes_list(state: FSMContext, chat_id: int, header: str, url: str, params: dict = None):
+    """
+    Начинаем новый список и возвращаем его первую страницу, как get_page
+    """
+    notes_list = {
+        'id': secrets.token_hex(4),
+        'header': header,
+        'url': url,
+        'params': params or {},
+        # курсор для каждой уже известной страницы, у первой курсора нет
+        'cursors': [None],
+    }
+    await state.update_data(notes_list=notes_list)
+    return await get_page(state, chat_id, notes_list, 0)
+
+
 @router.message(Command(commands=['start', 'help']))
 async def command_start_handler(message: Message):
     user = message.from_user.username
@@ -133,17 +430,18 @@ async def handle_email(message: Message, state: FSMContext):
 
         telegram_id = message.from_user.id
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{FASTAPI_URL}users/auth/link-accounts", json={
-                "email": email,
-                "telegram_id": telegram_id
-            })
-            if response.status_code == 200:
-                await message.answer("Accounts successfully linked!", reply_markup=inline_kb)
-                await state.clear()
-            else:
-                await message.answer("An error occupied during linking accounts. Pleasy try again")
-                # await state.clear()
+        response = await api.post("users/auth/link-accounts", json={
+            "email": email,
+            "telegram_id": telegram_id
+        })
+        if response.status_code == 200:
+            # сбрасываем закэшированный отрицательный ответ
+            linked_users.invalidate(telegram_id)
+            await message.answer("Accounts successfully linked!", reply_markup=inline_kb)
+            await state.clear()
+        else:
+            await message.answer("An error occupied during linking accounts. Pleasy try again")
+            # await state.clear()
 
     except EmailNotValidError as e:
         await message.answer(f"Wrong email: {str(e)}. Please try again.")
@@ -184,12 +482,11 @@ async def save_note_handler(message: Message, state: FSMContext):
     tags = [x.strip() for x in message.text.split(',')]
     if all(tag.isalnum() for tag in tags):
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{FASTAPI_URL}notes/tg/{user_id}", json={
-                "title": title,
-                "content": content,
-                "tags": tags,
-            })
+        response = await api.post(f"notes/tg/{user_id}", json={
+            "title": title,
+            "content": content,
+            "tags": tags,
+        })
 
         if response.status_code == 201:
             await message.answer("Your note has been successfully added!", reply_markup=inline_kb)
@@ -205,44 +502,104 @@ async def save_note_handler(message: Message, state: FSMContext):
 @router.callback_query(F.data == "search_by_tag")
 async def add_note_start_handler(call: CallbackQuery, state: FSMContext):
     await call.answer()
-    await call.message.answer("Please enter the tag you want to search for:")
+    await call.message.answer("Please enter the tags you want to search for (separated by commas):")
     await state.set_state("awaiting_tag")
 
 
 # получим пользовательский ввод - отправляем запрос на сервер, чтобы получить заметки с этим тегом
 @router.message(StateFilter("awaiting_tag"))
 async def handle_tag_search(message: Message, state: FSMContext):
-    tag = message.text.strip()
+    tags = [x.strip() for x in message.text.split(',') if x.strip()]
     user_id = message.from_user.id
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{FASTAPI_URL}notes/tg/{user_id}/search", params={"tag_search": tag,})
-        if response.status_code == 200:
-            notes = response.json()
-            if notes:
-                response = "\n\n".join([f"Title: {note['title']}\nContent: {note['content']}\nTags: {', '.join([x for x in note['tags']])}" for note in notes])
-                await message.reply(f"Notes found: \n\n{response}")
-            else:
-                await message.reply("No notes found with this tag.")
     await state.clear()
+    # заметка должна содержать все перечисленные теги
+    page = await open_notes_list(state, message.chat.id, "Notes found",
+                                 f"notes/tg/{user_id}/search", {"all": tags})
+    if page is not None:
+        text, markup = page
+        if text:
+            await message.reply(text, reply_markup=markup)
+        else:
+            # подсказываем существующие теги, похожие на последний введенный
+            suggestions = await api.get(f"notes/tg/{user_id}/tags/autocomplete",
+                                        params={"prefix": tags[-1][:64], "limit": 5})
+            names = [tag['name'] for tag in suggestions.json()] if suggestions.status_code == 200 else []
+            if names:
+                await message.reply(f"No notes found with these tags. Maybe you meant: {', '.join(names)}")
+            else:
+                await message.reply("No notes found with these tags.")
+    else:
+        await message.reply("Failed to search notes. Please try again.")
 
 # функция покажет все записи пользователя в БД
 @router.callback_query(F.data == "show_my_notes")
 async def show_my_notes_handler(call: CallbackQuery, state: FSMContext):
     user_id = call.from_user.id
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{FASTAPI_URL}notes/tg/{user_id}")
+    page = await open_notes_list(state, call.message.chat.id, "Your notes", f"notes/tg/{user_id}")
 
-        if response.status_code == 200:
-            notes = response.json()
-            if notes:
-                notes_text = "\n\n".join([f"Title: {note['title']}\nContent: {note['content']}\nTags: {', '.join([x for x in note['tags']])}" for note in notes])
-                await call.message.answer(f"Your notes:\n\n{notes_text}")
-                await call.answer()
-            else:
-                await call.answer("You have no notes.")
+    if page is not None:
+        text, markup = page
+        if text:
+            await call.message.answer(text, reply_markup=markup)
+            await call.answer()
         else:
-            await call.answer("Failed to retrieve your notes.")
+            await call.answer("You have no notes.")
+    else:
+        await call.answer("Failed to retrieve your notes.")
+
+
+# листаем список: запрашиваем нужную страницу и заменяем ей текст того же сообщения
+@router.callback_query(F.data.startswith("pg:"))
+async def notes_page_handler(call: CallbackQuery, state: FSMContext):
+    _, list_id, page = call.data.split(":")
+    page = int(page)
+    chat_id = call.message.chat.id
+
+    rendered = rendered_pages.get((chat_id, list_id, page))
+    if rendered is None:
+        notes_list = (await state.get_data()).get("notes_list")
+        # кнопки старого списка: курсоры уже заменены новым списком или сброшены
+        if not notes_list or notes_list['id'] != list_id or page >= len(notes_list['cursors']):
+            await call.answer("This list is outdated. Please open it again.", show_alert=True)
+            return
+        rendered = await get_page(state, chat_id, notes_list, page)
+        if rendered is None:
+            await call.answer("Failed to retrieve notes.")
+            return
+
+    text, markup = rendered
+    if not text:
+        await call.answer("No more notes.")
+        return
+    try:
+        await call.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as e:
+        # повторное нажатие на ту же кнопку: сообщение уже показывает эту страницу
+        if "message is not modified" not in str(e):
+            raise
+    await call.answer()
+
+
+# апи недоступно - вместо молчания сообщаем пользователю
+@dp.errors(ExceptionTypeFilter(ApiUnavailable))
+async def api_unavailable_handler(event: ErrorEvent):
+    text = "The service is temporarily unavailable. Please try again in a minute."
+    if event.update.message:
+        await event.update.message.answer(text)
+    elif event.update.callback_query:
+        await event.update.callback_query.answer(text, show_alert=True)
+
+
+@dp.startup()
+async def on_startup():
+    await api.start()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    await api.close()
+    logging.info(f"Linked users cache: hits={linked_users.hits}, misses={linked_users.misses}")
 
 
 async def main() -> None:
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+_MISSING = object()
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в файле SQLite в режиме WAL: состояние и данные диалогов переживают перезапуск бота.
+
+    Запись: изменения копятся в памяти и сбрасываются в файл одной транзакцией
+    раз в flush_interval секунд или сразу, как только накопилось batch_size ключей.
+    Чтение: недавно прочитанные ключи отдаются из LRU-кэша в памяти, не старше cache_ttl секунд.
+    Состояния, которые не менялись дольше state_ttl секунд, считаются брошенными и удаляются.
+
+    Несколько процессов бота могут работать с одним файлом: SQLite сериализует транзакции,
+    а состояние и данные обновляются раздельно, так что процессы не затирают поля друг друга.
+    Чужие изменения становятся видны не позже чем через flush_interval + cache_ttl.
+    """
+
+    def __init__(self, path: str,
+                 flush_interval: float = 0.05,
+                 batch_size: int = 100,
+                 cache_size: int = 10000,
+                 cache_ttl: float = 1.0,
+                 state_ttl: float = 7 * 24 * 3600,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.state_ttl = state_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        # ключ -> (state, data), поле _MISSING означает, что оно не менялось
+        self._pending: Dict[str, Tuple[Any, Any]] = {}
+        # ключ -> (state, data, момент чтения)
+        self._cache: OrderedDict[str, Tuple[Optional[str], Dict[str, Any], float]] = OrderedDict()
+        # растет при каждом изменении и при каждом сбросе: прочитанное из файла кэшируем, только если
+        # за время чтения он не изменился, иначе прочитанное могло устареть
+        self._generation = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_now = asyncio.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._last_purge = 0.0
+
+    # ----------- BaseStorage -------------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._write(self.key_builder.build(key), state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._write(self.key_builder.build(key), data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read(self.key_builder.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        # dispatcher закрывает хранилище при каждой остановке поллинга, поэтому после close
+        # хранилище остается рабочим и при следующем обращении заново откроет файл
+        # фоновый сброс не отменяем: отмена посреди записи теряет изменения, не вернув их в _pending.
+        # будим его, он делает последний сброс и выходит, остаток (например, после ошибки) сбрасываем сами
+        task, self._flush_task = self._flush_task, None
+        if task is not None and not task.done():
+            self._flush_now.set()
+            await task
+        await self.flush()
+        if self._executor is not None:
+            await self._run(self._close_connection)
+            self._executor.shutdown()
+            self._executor = None
+        self._cache.clear()
+
+    # ----------- чтение и запись -------------
+
+    async def _read(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[2] <= self.cache_ttl:
+            self._cache.move_to_end(key)
+            state, data = cached[0], cached[1]
+        else:
+            while True:
+                generation = self._generation
+                state, data = await self._run(self._select, key)
+                # за время чтения были изменения или сброс: сброс уже убрал свои изменения из _pending,
+                # а прочитанное их может не содержать - перечитываем; поток хранилища один,
+                # поэтому новое чтение выполнится после начатой записи
+                if generation == self._generation:
+                    self._remember(key, state, data)
+                    break
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            state = state if pending[0] is _MISSING else pending[0]
+            data = data if pending[1] is _MISSING else pending[1]
+        return state, data
+
+    def _write(self, key: str, state: Any = _MISSING, data: Any = _MISSING):
+        self._generation += 1
+        pending_state, pending_data = self._pending.get(key, (_MISSING, _MISSING))
+        self._pending[key] = (
+            pending_state if state is _MISSING else state,
+            pending_data if data is _MISSING else data,
+        )
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._remember(key,
+                           cached[0] if state is _MISSING else state,
+                           cached[1] if data is _MISSING else data)
+
+        if len(self._pending) >= self.batch_size:
+            self._flush_now.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        self._cache[key] = (state, data, time.monotonic())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _flush_later(self):
+        # пока идет сброс, могут накопиться новые изменения, поэтому крутимся, пока они есть;
+        # close снимает задачу с хранилища, и она выходит после текущего сброса
+        while self._pending and self._flush_task is asyncio.current_task():
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        Сбрасывает накопленные изменения в файл одной транзакцией
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._generation += 1
+        try:
+            await self._run(self._upsert, pending)
+        except Exception as e:
+            logging.error(f"FSM storage: failed to flush {len(pending)} keys: {e}")
+            # возвращаем изменения обратно, не затирая более свежие
+            for key, (state, data) in pending.items():
+                newer_state, newer_data = self._pending.get(key, (_MISSING, _MISSING))
+                self._pending[key] = (state if newer_state is _MISSING else newer_state,
+                                      data if newer_data is _MISSING else newer_data)
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            # одно соединение и один поток: sqlite3 не любит, когда соединение делят потоки
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # ----------- работа с файлом, выполняется в потоке хранилища -------------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_fsm_updated_at ON fsm (updated_at)")
+            self._connection = connection
+        return self._connection
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _select(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND updated_at >= ?",
+            (key, time.time() - self.state_ttl),
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _upsert(self, pending: Dict[str, Tuple[Any, Any]]):
+        now = time.time()
+        states = [(key, state, now) for key, (state, _) in pending.items() if state is not _MISSING]
+        data = [(key, json.dumps(value), now) for key, (_, value) in pending.items() if value is not _MISSING]
+
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                states,
+            )
+            connection.executemany(
+                "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                data,
+            )
+            # заодно время от времени удаляем брошенные и пустые записи
+            if now - self._last_purge > 60:
+                connection.execute(
+                    "DELETE FROM fsm WHERE updated_at < ? OR (state IS NULL AND data = '{}')",
+                    (now - self.state_ttl,),
+                )
+                self._last_purge = now
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise